@@ -15,29 +15,25 @@ import dash_bootstrap_components as dbc
 import visdcc
 import logging
 import math
+from html import escape as html_escape
 import functions as fn
+import jobs
+from graph_store import store as graph_store
+from hal_cache import cache
+from search_index import SearchIndex
+from layout import GraphLayout
+from metrics import metrics
 import config
+from flask import request, jsonify, abort, Response
 
 # config variables
 port = config.PORT
 host = config.HOST
 url_subpath = config.URL_SUBPATH
 
-# logs section
-class DashLoggerHandler(logging.StreamHandler):
-    def __init__(self):
-        logging.StreamHandler.__init__(self)
-        self.queue = []
-
-    def emit(self, record):
-        msg = self.format(record)
-        self.queue.append(msg)
-
-
+# logs section : the log lines of each harvest job are kept in a ring buffer of the job (see jobs.py) and streamed to the console of its page
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-dashLoggerHandler = DashLoggerHandler()
-logger.addHandler(dashLoggerHandler)
+logger.setLevel(logging.INFO)
 
 # Setup the app
 external_stylesheets=[dbc.themes.ZEPHYR]
@@ -109,6 +105,13 @@ select_harvest_direction = html.Div(
         ),
     ]
 )
+# component harvest depth : number of levels harvested, the others are harvested by a click on the structures of the last level
+input_harvest_depth = html.Div(
+    [
+        html.H5(dbc.Label("Profondeur")),
+        dbc.Input(id="harvest-depth", type="number", min=1, step=1, placeholder="tous les niveaux"),
+    ]
+)
 # component display in hierarchical way
 radio_hierarchical_enabled = html.Div(
     [
@@ -163,6 +166,9 @@ radio_nodes_size = html.Div(
             options=[
                 {"label": "non","value": "non"},
                 {"label": "oui", "value": "oui"},
+                {"label": "oui, en cumulant les publications des structures du dessous", "value": "nb_publis_total"},
+                {"label": "en fonction du nombre de structures du dessous", "value": "descendants"},
+                {"label": "en fonction du nombre de niveaux du dessous", "value": "height"},
             ],
             value="non",
             id="radio-nodes-size",
@@ -266,8 +272,10 @@ network_legend_type_s = html.Span(
     ]
 )
 # CONSOLE COMPONENT
+# the console is refreshed by the polling of the job (job-interval), the page keeps the number of the last line received (console-cursor)
 console = html.Div(children=[
-    dcc.Interval(id='interval-component', interval=1000, n_intervals=0),
+    dcc.Store(id='console-cursor'),
+    dcc.Store(id='console-chunk'),
     html.H1(id='div-out'),
     html.Iframe(id='console-out',srcDoc='',style={'width':'100%', 'height':300})
 ])
@@ -306,35 +314,44 @@ app.layout = dbc.Container(
                                 dbc.CardHeader(children=[
                                     dbc.Row([
                                         dbc.Col(
-                                            [input_struct_id], md=4),
+                                            [input_struct_id], md=3),
+                                        dbc.Col(
+                                            [select_harvest_direction], md=3),
                                         dbc.Col(
-                                            [select_harvest_direction], md=4),
+                                            [input_harvest_depth], md=2),
                                         dbc.Col(
                                             [
                                                 dbc.Button(
-                                                    "Valider", id="submit-button", color="primary", className="me-1", n_clicks_timestamp='0')
+                                                    "Valider", id="submit-button", color="primary", className="me-1", n_clicks_timestamp='0'),
+                                                dbc.Button(
+                                                    "Annuler", id="cancel-button", color="secondary", className="me-1", disabled=True)
                                             ],
                                             align="end",
-                                            md=2),
+                                            md=3),
                                     ]),
                                     dbc.Row([dbc.FormText("Attention (et patience) : selon la requête le temps de moissonnage des réponses de l'API peut être plus ou moins long. Exemples : "),
                                              dbc.FormText("docid 409 (researchteam) : 3 secondes"),
                                              dbc.FormText("docid 302940 (regrouplaboratory) : 45 secondes"),    
                                              dbc.FormText("docid 1039632 (institution) : 2 minutes"), 
+                                             dbc.FormText("Avec une profondeur, seuls les premiers niveaux sont moissonnés : un clic sur une structure du dernier niveau (bordure en pointillés) moissonne ses structures filles (ou parentes)."),
                                                    ]),
                                 ],
                                     style={"backgroundColor": "rgb(153, 217, 238)"}),
                                 dbc.CardBody(
                                     children=[
-                                        dbc.Spinner(html.Div(id="loading",
-                                                             children=[dcc.Store(id="edge-dict"),
-                                                                       dcc.Store(id="node-dict")]
-                                                             )
-                                                    ),
+                                        html.Div(id="loading",
+                                                 children=[dcc.Store(id="graph-id"),
+                                                           dcc.Store(id="job-id"),
+                                                           dcc.Store(id="job-version"),
+                                                           dcc.Interval(id="job-interval", interval=1000, disabled=True)]
+                                                 ),
+                                        html.Div(id="job-progress"),
                                         network_legend_valid_s,
                                         network_legend_type_s,
                                         alert_bar,
-                                        html.Div(id="network")
+                                        dcc.Store(id="network-state"),
+                                        html.Div(id="network",
+                                                 children=[visdcc.Network(id='graph', data={'nodes': [], 'edges': []}, options=fn.render_network_options())])
                                         ],
                                     style={"height": "80vh"},
                                 )
@@ -345,7 +362,7 @@ app.layout = dbc.Container(
                         dbc.Card(
                             [
                                 dbc.CardHeader("Tableau des structures"),
-                                dbc.CardBody(children=[html.Div(id="node-table")],
+                                dbc.CardBody(children=[html.Div(id="node-table", children=[fn.render_datatable([], [], id='node-datatable', custom=True)])],
                                              style={"height": "50%"}),
                             ],
                             color="success", outline=True,
@@ -395,52 +412,309 @@ app.layout = dbc.Container(
 )
 
 # SOME HELPERS FUNCTION
-def update_node_size(radio_nodes_size,node):
+def records(df):
+    """dataframe to list of dicts, with None for the missing values (as they come back from a dcc.Store)"""
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
+# filter operators of the DataTable queries, as they are written in filter_query
+FILTER_OPERATORS = [['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='], ['eq ', '='], ['contains '], ['datestartswith ']]
+
+def split_filter_part(filter_part):
+    """'{nb_publis} > 10' -> ('nb_publis', 'gt', 10.0)"""
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ''
+                if value_part and (v0 == value_part[-1]) and (v0 in ("'", '"', '`')):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                return name, operator_type[0].strip(), value
+    return [None] * 3
+
+def query_frame(df, sort_by, filter_query):
+    """vectorized filter (filter_query of a DataTable) and sort (sort_by of a DataTable) of a dataframe"""
+    for filter_part in (filter_query or '').split(' && '):
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        if col_name not in df.columns:
+            continue
+        column = df[col_name]
+        if operator in ('contains', 'datestartswith') or not pd.api.types.is_numeric_dtype(column):
+            # the ids are compared as text, 1039632 and not 1039632.0
+            if isinstance(filter_value, float) and filter_value.is_integer():
+                filter_value = int(filter_value)
+            column, filter_value = column.astype(str), str(filter_value)
+        elif isinstance(filter_value, str):
+            # a text compared to a number column : a number in quotes is compared as a number, any other text matches no number (NaN)
+            filter_value = pd.to_numeric(filter_value, errors='coerce')
+        if operator == 'contains':
+            df = df.loc[column.str.contains(filter_value, case=False, regex=False)]
+        elif operator == 'datestartswith':
+            df = df.loc[column.str.startswith(filter_value)]
+        elif operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            df = df.loc[getattr(column, operator)(filter_value)]
+    if sort_by:
+        df = df.sort_values([col['column_id'] for col in sort_by], ascending=[col['direction'] == 'asc' for col in sort_by],
+                            key=lambda column: column if pd.api.types.is_numeric_dtype(column) else column.astype(str), kind='stable')
+    return df
+
+def update_node_size(radio_nodes_size, nb_publis):
+    """vectorized node sizes of a series of publications counts"""
     if radio_nodes_size == "non":
-         size = 7
-    else:
-        if node['nb_publis'] != 0:
-            size = round(math.log(int(node['nb_publis'])*5))
+        return pd.Series(7, index=nb_publis.index)
+    nb_publis = pd.to_numeric(nb_publis, errors='coerce').fillna(0)
+    return pd.Series(np.where(nb_publis > 0, np.round(np.log(nb_publis.clip(lower=1) * 5)), 5).astype(int), index=nb_publis.index)
+
+# modes of radio-nodes-size by statistics of the structures under each structure
+ROLLUP_SIZES = ['nb_publis_total', 'descendants', 'height']
+
+def node_sizes(graph, render, radio_nodes_size):
+    """
+    node sizes of a mode of radio-nodes-size : the sizes by publications count are computed with the render frame,
+    the ones by statistics of the structures under each structure when first used (see rollups in graph_data.py)
+    """
+    if radio_nodes_size in ('non', 'oui'):
+        return render['nodes']['size_' + radio_nodes_size].values
+    if radio_nodes_size not in render['sizes']:
+        rollups = graph.rollups()
+        if radio_nodes_size == 'nb_publis_total':
+            # same scale as the publications of the structure
+            sizes = update_node_size('oui', rollups['nb_publis_total'])
+        elif radio_nodes_size == 'descendants':
+            sizes = np.round(5 + 3 * np.log1p(rollups['descendants'])).astype(int)
         else:
-            size = 5
-    return size
+            sizes = 5 + 3 * rollups['height']
+        render['sizes'][radio_nodes_size] = sizes.values
+    return render['sizes'][radio_nodes_size]
+
+def render_frame(graph):
+    """
+    Node render attributes (title, color and size by mode, shape by mode) and edges records, computed once per harvested graph
+    and kept with the graph in the worker memory (see graph_store.py and graph_data.py)
+    """
+    if 'render' not in graph.cache:
+        with metrics.timer('aurehal_render_seconds', step='frame'):
+            node_df = graph.nodes
+            frame = pd.DataFrame({'id': node_df['id'], 'label': node_df['acronym_s'], 'valid_s': node_df['valid_s'], 'type_s': node_df['type_s']})
+            frame = frame.astype(object).where(frame.notna(), None)
+            #node title for tooltip
+            frame['title'] = ['{} (id:{}) ({} publis) ({})'.format(node['label_s'], node['id'], node['nb_publis'], node['valid_s'])
+                              for node in records(node_df[['label_s', 'id', 'nb_publis', 'valid_s']])]
+            for mode in ['valid_s', 'type_s']:
+                frame['color_' + mode] = frame[mode].map(COLORS)
+            for mode in ['non', 'oui']:
+                frame['size_' + mode] = update_node_size(mode, node_df['nb_publis'])
+            frame['shape_dot'] = 'dot'
+            frame['shape_no_dot'] = np.where(node_df['has_idref'], 'image', 'dot')
+            # the structures of the frontier of a harvest limited in depth are expanded by a click
+            frame['frontier'] = np.isin(node_df['id'].values, graph.frontier)
+            frame.loc[frame['frontier'], 'title'] = frame.loc[frame['frontier'], 'title'] + " : cliquer pour moissonner la suite"
+            edges = [{'from': f, 'to': t, 'id': str(f) + "__" + str(t), 'color': {'color': '#97C2FC'}}
+                     for f, t in zip(graph.ids[graph.src].tolist(), graph.ids[graph.dst].tolist())]
+            graph.cache['render'] = {'nodes': frame, 'edges': edges, 'sizes': {}}
+    return graph.cache['render']
+
+def search_index(graph):
+    """search index of a graph, built with the harvest (see jobs.py) or here for a graph stored without one"""
+    if graph.index is None:
+        index = SearchIndex()
+        index.add(graph.nodes, records(graph.edge_frame()))
+        graph.index = index
+    return graph.index
 
-def filter_condition(input_filter_node_title,checklist_valid_s_colors, checklist_type_s_colors,node,title):
-    condition = (node["valid_s"] in checklist_valid_s_colors) & (
-                    node["type_s"] in checklist_type_s_colors)
-    if input_filter_node_title is not None:
-        condition = (node["valid_s"] in checklist_valid_s_colors) & (
-                    node["type_s"] in checklist_type_s_colors) & (str(input_filter_node_title) in title)
-    return condition
+def filter_mask(frame, index, input_filter_node_title, checklist_valid_s_colors, checklist_type_s_colors):
+    """
+    vectorized filter of the render frame on the status and the type, and search of the title in the index of the graph :
+    returns the mask of the nodes to display (the matching structures and their paths to the root) and the mask of the matching structures
+    """
+    mask = frame['valid_s'].isin(checklist_valid_s_colors).values & frame['type_s'].isin(checklist_type_s_colors).values
+    matched = np.zeros(len(frame), dtype=bool)
+    if input_filter_node_title:
+        matches = [pos for pos in index.search(input_filter_node_title) if pos < len(frame)]
+        shown = np.zeros(len(frame), dtype=bool)
+        shown[[pos for pos in index.ancestors(matches) if pos < len(frame)]] = True
+        matched[matches] = True
+        mask = mask & shown
+    return mask, matched
 
 # CALLBACKS
-@app.callback(Output('edge-dict', 'data'),
-              Output('node-dict', 'data'),
-              Output('node-table', 'children'),
+@app.callback(Output('job-id', 'data'),
+              Output('job-version', 'data'),
+              Output('job-interval', 'disabled'),
+              Output('cancel-button', 'disabled'),
+              Output('job-progress', 'children'),
+              Output('graph-id', 'data'),
               [Input('docid', 'value'),
               Input('select-harvest-direction', 'value'),
-              Input("submit-button", "n_clicks")],
+              Input("submit-button", "n_clicks"),
+              Input("cancel-button", "n_clicks"),
+              Input('job-interval', 'n_intervals'),
+              Input('graph', 'selection')],
+              State('harvest-depth', 'value'),
+              State('job-id', 'data'),
+              State('job-version', 'data'),
               prevent_initial_call=True)
-def update_states(docid, select_harvest_direction, n_clicks):
+def update_states(docid, select_harvest_direction, n_clicks, n_clicks_cancel, n_intervals, selection, harvest_depth, job_id, job_version):
     trig_id = dash.callback_context.triggered[0]["prop_id"].split(".")[0]
     if (trig_id == "docid") | (trig_id == "select-harvest-direction"):
         return dash.no_update
-    elif trig_id == "submit-button":
-        if select_harvest_direction == "desc":
-            edge_df = pd.DataFrame(fn.get_child_struct(docid, None))
-        elif select_harvest_direction == "asc":
-            edge_df = pd.DataFrame(fn.get_parent_struct(docid, None))
-        if not edge_df.empty:
-            list_unique_docid = set(edge_df["from"].unique().tolist()+edge_df["to"].unique().tolist())
-            node_df = fn.get_list_struct_infos(list_unique_docid)
-            columns = [{"name": str(i), "id": str(i)} for i in node_df.columns]
-            return edge_df.to_dict(orient='records'), node_df.to_dict(orient='records'), fn.render_datatable(columns, node_df.to_dict(orient='records'))
-        else:
-            return None, None, None
+    elif (trig_id == "submit-button") & (str(docid).strip().isdigit()):
+        # the harvest runs in background, the graph is filled in by the polling of the job
+        max_depth = int(harvest_depth) if harvest_depth else None
+        return jobs.submit_job(docid.strip(), select_harvest_direction, max_depth=max_depth), None, False, False, None, None
+    elif (trig_id == "cancel-button") & (job_id is not None):
+        jobs.cancel_job(job_id)
+        return dash.no_update, dash.no_update, dash.no_update, True, dash.no_update, dash.no_update
+    elif (trig_id == "job-interval") & (job_id is not None):
+        return poll_job(job_id, job_version)
+    elif (trig_id == "graph") & (job_id is not None) & bool(selection) and selection['nodes']:
+        # a click on a structure of the frontier of a harvest limited in depth harvests its neighbours in background,
+        # the polling of the job is restarted to get them
+        if jobs.expand_node(job_id, selection['nodes'][0]) is None:
+            return dash.no_update
+        return poll_job(job_id, job_version)
     else:
-        return None, None, None
+        return dash.no_update
+
+def poll_job(job_id, job_version):
+    """
+    Returns the outputs of update_states for the current state of a job.
+    The harvested graph stays server-side (see graph_store.py), the page only gets its id and version, and only when it changed.
+    """
+    job = jobs.get_job(job_id)
+    if job is None:
+        return None, None, True, True, None, None
+    # a structure of the frontier being expanded (see jobs.expand_node) is polled as a running harvest, which can't be cancelled
+    expanding = jobs.is_expanding(job)
+    running = (job['status'] == 'running') or expanding
+    progress = '{} niveau(x) moissonné(s), {} structures, {} requêtes HAL'.format(
+        job['progress']['levels'], job['progress']['nodes'], job['progress']['requests'])
+    if expanding:
+        progress = [dbc.Spinner(size="sm"), " ", progress + ', moissonnage des voisins de la structure {}'.format(job['expanding'])]
+    elif running:
+        progress = [dbc.Spinner(size="sm"), " ", progress]
+    elif job['status'] == 'cancelled':
+        progress = progress + ' (annulé)'
+    elif job['status'] == 'error':
+        progress = progress + ' (erreur : {})'.format(job['error'])
+    elif job.get('truncated'):
+        progress = [progress + ' ', dbc.Badge("résultat partiel", color="warning", className="me-1"),
+                    "limite de temps ou de nombre de structures atteinte : cliquer sur les structures en pointillés pour poursuivre le moissonnage"]
+    states = [job_id, job['version'], not running, not running or expanding, progress]
+    if job['version'] == job_version:
+        return tuple(states + [dash.no_update])
+    if job['progress']['edges']:
+        return tuple(states + [{'id': job_id, 'version': job['version']}])
+    elif running:
+        # nothing to draw before the first level
+        return tuple(states + [dash.no_update])
+    else:
+        return tuple(states + [None])
+
+@app.callback(Output('node-datatable', 'data'),
+              Output('node-datatable', 'columns'),
+              Output('node-datatable', 'page_count'),
+              [Input('node-datatable', 'page_current'),
+              Input('node-datatable', 'page_size'),
+              Input('node-datatable', 'sort_by'),
+              Input('node-datatable', 'filter_query'),
+              Input('graph-id', 'data')],
+              prevent_initial_call=True)
+def update_table(page_current, page_size, sort_by, filter_query, graph_id):
+    """
+    The structures table is paged, sorted and filtered by the server on the nodes dataframe of the graph (see graph_store.py) :
+    the page only gets the rows of the displayed page
+    """
+    graph = graph_store.get(graph_id['id']) if graph_id is not None else None
+    if graph is None:
+        return [], [], 0
+    if 'table' not in graph.cache:
+        # the has_idref flag is shown and filtered as text ({has_idref} = oui), not as a number
+        graph.cache['table'] = graph.nodes.assign(has_idref=pd.Categorical(np.where(graph.nodes['has_idref'], 'oui', 'non'), categories=['non', 'oui']))
+    node_df = graph.cache['table']
+    columns = [{"name": str(i), "id": str(i), "type": "numeric" if pd.api.types.is_numeric_dtype(node_df[i]) else "text"} for i in node_df.columns]
+    df = query_frame(node_df, sort_by, filter_query)
+    page_count = max(math.ceil(len(df) / page_size), 1)
+    page = min(page_current or 0, page_count - 1)
+    return records(df.iloc[page * page_size:(page + 1) * page_size]), columns, page_count
+
+def graph_layout(graph, render):
+    """server-side hierarchical layout of a graph (see layout.py), computed once per graph version and kept with its render frame"""
+    if 'layout' not in render:
+        with metrics.timer('aurehal_render_seconds', step='layout'):
+            # the rows of the structures are their positions in the layout
+            render['layout'] = GraphLayout(len(render['nodes']), zip(graph.src.tolist(), graph.dst.tolist()))
+    return render['layout']
+
+def visible_nodes(graph, render, params, nb_nodes):
+    """vis.js records (as a dataframe indexed by the rows of the graph nodes) of the nodes displayed with a set of controls values, among the nb_nodes first nodes"""
+    frame = render['nodes'].iloc[:nb_nodes]
+    mask, matched = filter_mask(frame, search_index(graph), params['title'], params['valid_s'], params['type_s'])
+    nodes = pd.DataFrame({'id': frame['id'], 'label': frame['label'], 'shape': frame['shape_' + params['form']], 'image': app.get_asset_url('idref_logo.png'),
+                          'size': node_sizes(graph, render, params['size'])[:nb_nodes], 'title': frame['title'], 'color': frame['color_' + params['color']],
+                          'borderWidth': np.where(matched, 4, 1),
+                          'shapeProperties': [{'borderDashes': [5, 5] if frontier else False} for frontier in frame['frontier']]}, index=frame.index)
+    if params['size'] in ROLLUP_SIZES:
+        rollups = graph.rollups().iloc[:nb_nodes]
+        nodes['title'] = nodes['title'] + [' ({} structures et {} publis en cumulant les structures du dessous)'.format(d, p) if d else ''
+                                           for d, p in zip(rollups['descendants'], rollups['nb_publis_total'])]
+    if params['layout']:
+        layout = graph_layout(graph, render)
+        nodes['x'], nodes['y'] = [position[:nb_nodes] for position in layout.positions(params['direction'])]
+        # the large subtrees are collapsed in their top structure, except during a search
+        if (len(render['nodes']) > config.LAYOUT_CLUSTER_NODES) and not params['title']:
+            positions = search_index(graph).positions
+            collapsed, hidden = layout.clusters([positions[i] for i in params['expanded'] if i in positions])
+            collapsed, hidden = collapsed[:nb_nodes], hidden[:nb_nodes]
+            sizes = layout.subtree[:nb_nodes][collapsed] - 1
+            nodes.loc[collapsed, 'label'] = nodes.loc[collapsed, 'label'].astype(str) + [' (+{})'.format(size) for size in sizes]
+            nodes.loc[collapsed, 'title'] = nodes.loc[collapsed, 'title'] + [' : cliquer pour afficher les {} structures du dessous'.format(size) for size in sizes]
+            nodes.loc[collapsed, 'shape'] = 'box'
+            mask = mask & ~hidden
+    return nodes[mask]
+
+def network_diff(graph_id, graph, render, params, state):
+    """
+    Javascript run in the visdcc network (this.nn and this.ee are its nodes and edges datasets) to go from the network described by the
+    previous state (graph id, number of nodes and edges sent, controls values) to the current one : the nodes no longer displayed are removed,
+    the new ones added and the others only get the attributes that changed, so vis.js keeps their positions.
+    A new graph replaces the content of the network, as well as a switch between the vis.js and the server-side layouts, and a new level
+    of a graph with a server-side layout (the positions and the clusters of the previous nodes change).
+    """
+    nodes = visible_nodes(graph, render, params, len(render['nodes']))
+    if (state is None) or (state['graph'] != graph_id) or (state['params']['layout'] != params['layout']) \
+            or (params['layout'] and (state['nodes'] != len(render['nodes']))):
+        return 'this.nn.clear();this.ee.clear();this.nn.add({});this.ee.add({});this.net.fit();'.format(
+            json.dumps(records(nodes)), json.dumps(render['edges']))
+    before = visible_nodes(graph, render, state['params'], state['nodes'])
+    removed = before.index.difference(nodes.index)
+    added = nodes.index.difference(before.index)
+    kept = nodes.index.intersection(before.index)
+    # the missing values (no color for an unknown type) compare as equal
+    changed = nodes.loc[kept].fillna('').ne(before.loc[kept].fillna(''))
+    if (params['size'] in ROLLUP_SIZES) and (state['nodes'] != len(render['nodes'])):
+        # the new structures change the rollups of the structures above them
+        changed[['size', 'title']] = True
+    columns = [column for column in nodes.columns if changed[column].any()]
+    updates = nodes.loc[kept[changed.any(axis=1).values], ['id'] + [column for column in columns if column != 'id']]
+    script = ''
+    if len(removed):
+        script += 'this.nn.remove({});'.format(json.dumps(list(before.loc[removed, 'id'].astype(object))))
+    if len(added) or len(updates):
+        script += 'this.nn.update({});'.format(json.dumps(records(nodes.loc[added]) + records(updates)))
+    if len(render['edges']) > state['edges']:
+        script += 'this.ee.update({});'.format(json.dumps(render['edges'][state['edges']:]))
+    return script
 
-@app.callback(Output('network', 'children'),
+@app.callback(Output('graph', 'run'),
+              Output('graph', 'options'),
+              Output('network-state', 'data'),
               [Input("radio-nodes-color", "value"),
               Input("radio-nodes-size", "value"),
               Input("radio-nodes-form", "value"),
@@ -449,49 +723,111 @@ def update_states(docid, select_harvest_direction, n_clicks):
               Input("radio-hierarchical-enabled", "value"),
               Input("select-hierarchical-direction", "value"),
               Input("input-filter-node-title", "value"),
-              Input("edge-dict", "data"),
-              Input("node-dict", "data")],
+              Input("graph-id", "data"),
+              Input("graph", "selection")],
+              State('network-state', 'data'),
               prevent_initial_call=True
               )
-def render_network(radio_nodes_color, radio_nodes_size, radio_nodes_form,checklist_valid_s_colors, checklist_type_s_colors, radio_hierarchical_enabled, select_hierarchical_direction, input_filter_node_title, edge_dict, node_dict):
-    edges = []
-    nodes = []
-    if (node_dict is not None) & (edge_dict is not None):
+def render_network(radio_nodes_color, radio_nodes_size, radio_nodes_form,checklist_valid_s_colors, checklist_type_s_colors, radio_hierarchical_enabled, select_hierarchical_direction, input_filter_node_title, graph_id, selection, network_state):
+    """
+    The network stays in the page and is updated in place (see network_diff) : a filter or a style change only sends the nodes that
+    appear, disappear or change, and the new levels of a harvest only their nodes and edges.
+    With the hierarchical option, or for the graphs of more than config.LAYOUT_MIN_NODES structures, the positions are computed by the server
+    (see layout.py) and the physics is disabled. A click on a cluster node expands it.
+    """
+    trig_id = dash.callback_context.triggered[0]["prop_id"].split(".")[0]
+    graph = graph_store.get(graph_id['id']) if graph_id is not None else None
+    if graph is not None:
+        render = render_frame(graph)
+        expanded = network_state['params']['expanded'] if (network_state is not None) and (network_state['graph'] == graph_id['id']) else []
+        if trig_id == "graph":
+            if (network_state is None) or (not selection) or (not selection['nodes']):
+                raise PreventUpdate
+            expanded = expanded + [str(selection['nodes'][0])]
+        params = {'color': radio_nodes_color, 'size': radio_nodes_size, 'form': radio_nodes_form, 'valid_s': checklist_valid_s_colors,
+                  'type_s': checklist_type_s_colors, 'title': input_filter_node_title, 'direction': select_hierarchical_direction,
+                  'layout': bool(radio_hierarchical_enabled) or (len(render['nodes']) > config.LAYOUT_MIN_NODES), 'expanded': expanded}
+        OPTIONS = fn.render_network_options(
+            hierarchical_enabled=radio_hierarchical_enabled, direction=select_hierarchical_direction, fixed_positions=params['layout'])
+        with metrics.timer('aurehal_render_seconds', step='network'):
+            script = network_diff(graph_id['id'], graph, render, params, network_state)
+        state = {'graph': graph_id['id'], 'nodes': len(render['nodes']), 'edges': len(render['edges']), 'params': params, 'options': OPTIONS}
+        if (network_state is not None) and (network_state['options'] == OPTIONS):
+            OPTIONS = dash.no_update
+        if (not script) and (OPTIONS is dash.no_update) and (trig_id == "graph"):
+            # a click on a structure which is not a cluster
+            raise PreventUpdate
+        return script or dash.no_update, OPTIONS, state
+    elif trig_id in ("radio-hierarchical-enabled", "select-hierarchical-direction"):
         OPTIONS = fn.render_network_options(
             hierarchical_enabled=radio_hierarchical_enabled, direction=select_hierarchical_direction)
-        for row in edge_dict:
-            edges.append({**row, **{'id': str(row['from']) + "__" + str(row['to']),  'color': {'color': '#97C2FC'}}})
-        for node in node_dict:
-            #node title for tooltip
-            title = '{} (id:{}) ({} publis) ({})'.format(node['label_s'], node['id'],node['nb_publis'],node['valid_s'])
-            if filter_condition(input_filter_node_title,checklist_valid_s_colors, checklist_type_s_colors,node,title):
-                print(node[radio_nodes_form])
-                nodes.append({**node, **{'label': node['acronym_s'], 'shape': node[radio_nodes_form], 'image':app.get_asset_url('idref_logo.png'),
-                    'size': update_node_size(radio_nodes_size,node), 'title': title, 'color': COLORS[node[radio_nodes_color]]}})
-        graphdata = {'nodes': nodes, 'edges': edges}
-        return visdcc.Network(id='graph', data=graphdata, options=OPTIONS)
+        return dash.no_update, OPTIONS, dash.no_update
+    elif network_state is not None:
+        return 'this.nn.clear();this.ee.clear();', dash.no_update, None
     else:
-        return None
+        raise PreventUpdate
 
 @app.callback(
-    Output('console-out', 'srcDoc'),
-    Input('interval-component', 'n_intervals')
-    #[Input('console-button', 'n_clicks')]
+    Output('console-chunk', 'data'),
+    Output('console-cursor', 'data'),
+    [Input('job-interval', 'n_intervals'),
+    Input('job-id', 'data'),
+    Input('graph-id', 'data')],
+    State('console-cursor', 'data'),
+    prevent_initial_call=True
     )
-def update_output(n):
-    #if n_clicks != 0:
-    return ('\n'.join(dashLoggerHandler.queue)).replace('\n', '<BR>')
+def update_output(n, job_id, graph_id, cursor):
+    """Sends the log lines of the job after the cursor of the page, all of them (reset) for a new job"""
+    if job_id is None:
+        raise PreventUpdate
+    reset = (cursor is None) or (cursor['job'] != job_id)
+    seq, lines = jobs.get_log(job_id, 0 if reset else cursor['seq'])
+    if (not lines) and (not reset):
+        raise PreventUpdate
+    return {'reset': reset, 'lines': [html_escape(line) for line in lines]}, {'job': job_id, 'seq': seq}
+
+# the new lines are appended in the browser, which keeps the last config.JOBS_LOG_LINES ones
+app.clientside_callback(
+    """
+    function(chunk, doc) {
+        if (!chunk) {
+            return window.dash_clientside.no_update;
+        }
+        var lines = (chunk.reset || !doc) ? [] : doc.split('<BR>');
+        lines = lines.concat(chunk.lines).slice(-%d);
+        return lines.join('<BR>');
+    }
+    """ % config.JOBS_LOG_LINES,
+    Output('console-out', 'srcDoc'),
+    Input('console-chunk', 'data'),
+    State('console-out', 'srcDoc')
+)
 
 @app.callback(
     Output('alert-bar', 'style'),
-    [Input('network', 'children')],
+    [Input('graph-id', 'data')],
     prevent_initial_call=True)
-def info_nodata(network):
-    if network is None:
+def info_nodata(graph_id):
+    if graph_id is None:
         return {'display': 'block'}
     else:
         return {'display': 'none'}
 
+# ADMIN ROUTES
+@server.route(url_subpath + 'admin/cache/purge/<int:docid>', methods=['POST'])
+def purge_cache_docid(docid):
+    """Purges the cached HAL responses involving a structure (header X-Admin-Token required)"""
+    if (not config.ADMIN_TOKEN) | (request.headers.get('X-Admin-Token') != config.ADMIN_TOKEN):
+        abort(403)
+    deleted = cache.purge_docid(docid) if cache is not None else 0
+    return jsonify({'docid': docid, 'deleted': deleted})
+
+# METRICS ROUTE
+@server.route(url_subpath + 'metrics')
+def metrics_route():
+    """Metrics of the HAL requests, of the cache, of the harvests and of the rendering summed over the processes, in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 
 if __name__ == "__main__":
     app.run_server(debug=True,port=port, host=host)
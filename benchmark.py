@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import argparse
+import tracemalloc
+import config
+import functions as fn
+import hal_stub
+from hal_client import client, TokenBucket
+
+# -----HARVEST BENCHMARK-------
+# Runs get_child_struct/get_parent_struct and get_list_struct_infos against an in-process HAL stub with a simulated latency,
+# on synthetic graphs shaped like the examples of the app (docids 409, 302940, 1039632) and larger ones.
+# Reports wall time, number of requests, bytes received and peak memory by scenario, and compares them with a stored baseline.
+# The HAL responses cache, the local snapshot and the rate limiter are disabled so that every run measures the same requests.
+#
+# python benchmark.py                    run and compare with benchmark_baseline.json
+# python benchmark.py --save-baseline    run and store the results as the new baseline
+
+# name : (root docid, direction, depth, fanout, multi-parent rate)
+SCENARIOS = {
+    '409': (409, 'asc', 5, 2, 0.3),
+    '302940': (302940, 'desc', 3, 6, 0.05),
+    '1039632': (1039632, 'desc', 4, 6, 0.1),
+    'synthetic-20k': (1, 'desc', 5, 7, 0.1),
+}
+BASELINE_PATH = 'benchmark_baseline.json'
+# metric : (relative increase, absolute slack) reported as a regression, the peak memory is noisier than the requests and bytes
+TOLERANCES = {
+    'wall_s': (0.2, 0.05),
+    'requests': (0.2, 0),
+    'bytes': (0.2, 0),
+    'peak_mem_kb': (0.3, 256),
+}
+
+
+def measure(stub, function, *args):
+    stub.reset_counters()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    wall = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {'wall_s': round(wall, 3), 'requests': stub.requests, 'bytes': stub.bytes, 'peak_mem_kb': peak // 1024}
+
+
+def run_scenario(name, latency):
+    root, direction, depth, fanout, multi_parent_rate = SCENARIOS[name]
+    records = hal_stub.synthetic(root, depth, fanout, multi_parent_rate)
+    stub = hal_stub.StubHal(records, latency=latency)
+    client.transport = hal_stub.StubTransport(stub)
+    if direction == 'asc':
+        # harvest the parents of the last structure of the deepest level
+        start, harvest = max(records.keys()), fn.get_parent_struct
+    else:
+        start, harvest = root, fn.get_child_struct
+    edges, harvest_stats = measure(stub, harvest, str(start), None)
+    docids = set([e['from'] for e in edges] + [e['to'] for e in edges])
+    nodes, infos_stats = measure(stub, fn.get_list_struct_infos, docids)
+    return {'nodes': len(nodes), 'edges': len(edges), harvest.__name__: harvest_stats, 'get_list_struct_infos': infos_stats}
+
+
+def compare(results, baseline):
+    """Returns the list of the regressions of the results compared to the baseline"""
+    regressions = []
+    for name, result in results.items():
+        for step, stats in result.items():
+            if not isinstance(stats, dict) or step not in baseline.get(name, {}):
+                continue
+            for metric, (tolerance, slack) in TOLERANCES.items():
+                if metric not in baseline[name][step]:
+                    continue
+                before, after = baseline[name][step][metric], stats[metric]
+                if after > before * (1 + tolerance) + slack:
+                    regressions.append('{} {} {} : {} -> {}'.format(name, step, metric, before, after))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the harvest functions against a local HAL stub")
+    parser.add_argument('--latency', type=float, default=0.05, help="simulated latency of a HAL response in seconds")
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS.keys()), help="scenario to run (all by default)")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true')
+    args = parser.parse_args()
+    fn.cache = None
+    config.SNAPSHOT_ENABLED = False
+    client.bucket = TokenBucket(rate=1e9, burst=1e9)
+    results = {}
+    for name in args.scenario or SCENARIOS.keys():
+        results[name] = run_scenario(name, args.latency)
+        print(name, json.dumps(results[name]))
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'latency': args.latency, 'results': results}, f, indent=2)
+    else:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            baseline = None
+        if baseline is None:
+            print('no baseline found in {}'.format(args.baseline))
+        elif baseline['latency'] != args.latency:
+            print('baseline measured with a latency of {}s, not compared'.format(baseline['latency']))
+        else:
+            regressions = compare(results, baseline['results'])
+            for regression in regressions:
+                print('REGRESSION', regression)
+            if regressions:
+                raise SystemExit(1)
+            print('no regression')
@@ -1,4 +1,78 @@
+import os
+
 #Config variables
 PORT = '8050'
 HOST = '0.0.0.0'
-URL_SUBPATH = '/aurehal-network/'
\ No newline at end of file
+URL_SUBPATH = '/aurehal-network/'
+
+#HAL responses cache (shared by all the workers)
+CACHE_ENABLED = True
+CACHE_PATH = os.environ.get('AUREHAL_CACHE_PATH', 'hal_cache.sqlite')
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+#time to live in seconds by HAL endpoint
+CACHE_TTL = {'ref/structure': 24 * 3600, 'search': 6 * 3600}
+#expired responses are still served during this time (in seconds) while they are refreshed in background
+CACHE_STALE = 7 * 24 * 3600
+#an url being requested by a process is awaited by the others in the cache (polled every CACHE_CLAIM_POLL seconds),
+#its claim expires after CACHE_CLAIM_LEASE seconds if the process died without releasing it
+CACHE_CLAIM_LEASE = 300
+CACHE_CLAIM_POLL = 0.05
+#token required by the admin routes (disabled if empty)
+ADMIN_TOKEN = os.environ.get('AUREHAL_ADMIN_TOKEN', '')
+
+#local snapshot of the Aurehal referential (built with : python snapshot.py build)
+SNAPSHOT_ENABLED = True
+SNAPSHOT_DIR = os.environ.get('AUREHAL_SNAPSHOT_DIR', 'snapshot')
+SNAPSHOT_ROWS = 10000
+
+#HAL API client
+#base url of the HAL API (set it to a local stub server, see hal_stub.py, to work offline)
+HAL_API_URL = os.environ.get('AUREHAL_HAL_API_URL', 'https://api.archives-ouvertes.fr/')
+HAL_MAX_CONCURRENCY = 10
+#requests per second (token bucket) and burst
+HAL_RATE = 20
+HAL_BURST = 20
+#timeout in seconds of a request, and number of attempts on network errors, 429 and 5xx responses
+HAL_TIMEOUT = 30
+HAL_RETRIES = 4
+
+#background harvest jobs, their state is shared by the workers through JOBS_DIR
+JOBS_DIR = os.environ.get('AUREHAL_JOBS_DIR', 'jobs')
+JOBS_WORKERS = 4
+#time in seconds before the files of a job are deleted
+JOBS_TTL = 24 * 3600
+#bounds of the harvests of the app : time budget and timeout of each HAL request in seconds, maximum number of structures
+#the harvest stops when one of them is reached and the partial graph is displayed
+JOBS_DEADLINE = 300
+JOBS_MAX_NODES = 50000
+JOBS_REQUEST_TIMEOUT = 20
+#number of log lines kept by job (ring buffer) and displayed in the console of the page
+JOBS_LOG_LINES = 500
+
+#lock files coalescing the identical harvests of the workers
+LOCKS_DIR = os.environ.get('AUREHAL_LOCKS_DIR', 'locks')
+#a running job whose state has not been updated for this time (in seconds) is considered dead
+JOBS_STALE = 600
+
+#server-side store of the harvested graphs
+GRAPHS_DIR = os.environ.get('AUREHAL_GRAPHS_DIR', 'graphs')
+#number of graphs kept in memory by worker
+GRAPHS_MEMORY = 20
+#time in seconds before a graph is deleted
+GRAPHS_TTL = 24 * 3600
+
+#server-side layout of the networks
+#above this number of structures the positions are computed by the server and the physics is disabled, even without the hierarchical option
+LAYOUT_MIN_NODES = 1000
+#above this number of structures the subtrees larger than LAYOUT_CLUSTER_SIZE are collapsed in a cluster node (expanded by a click)
+LAYOUT_CLUSTER_NODES = 2000
+LAYOUT_CLUSTER_SIZE = 200
+#crossing reduction sweeps (down then up)
+LAYOUT_SWEEPS = 4
+LAYOUT_LEVEL_SEPARATION = 150
+LAYOUT_NODE_SPACING = 100
+
+#metrics of the HAL requests, of the cache and of the harvests (route metrics, Prometheus text format), written by each process in METRICS_DIR
+METRICS_DIR = os.environ.get('AUREHAL_METRICS_DIR', 'metrics')
+#minimum time in seconds between two writes of the metrics of a process
+METRICS_FLUSH = 5
@@ -1,17 +1,211 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
 import numpy as np
-import requests
 import json
 from dash import dcc
 from dash import html
 from dash import dash_table as dt
 import dash_bootstrap_components as dbc
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import logging
+import time
+import contextvars
+import config
+from hal_cache import cache, endpoint_of
+from hal_client import client
+from singleflight import SingleFlight
+from snapshot import load_snapshot, META_FIELDS
+from metrics import metrics
+
+# -----HAL API-------
+
+# progress dict of the current harvest job (see jobs.py), its "requests" key counts the requests sent to the HAL API
+harvest_progress = contextvars.ContextVar('harvest_progress', default=None)
+
+# timeout in seconds of the requests sent to the HAL API by the current harvest (config.HAL_TIMEOUT by default),
+# and its deadline (time.monotonic() value) after which the requests are not retried
+request_timeout = contextvars.ContextVar('request_timeout', default=None)
+request_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+# urls (or per-structure keys, see hal_get_by_docid) being requested to the HAL API by the threads of the process
+flights = SingleFlight()
+
+# urls being refreshed in background (stale-while-revalidate)
+refreshing = set()
+refreshing_lock = threading.Lock()
+
+def store(url, body):
+    if cache is not None:
+        cache.set(url, body)
+    return body
+
+def refresh(url):
+    try:
+        store(url, client.get(url))
+    finally:
+        with refreshing_lock:
+            refreshing.discard(url)
+
+def cached(url, count=True):
+    """
+    Returns the cached response body of an url or None.
+    A fresh cached response is returned as is, an expired one is still returned while it is refreshed in background (if in the config.CACHE_STALE window).
+    The lookup is counted in the cache metrics unless count is False (second lookup of an url).
+    """
+    if cache is None:
+        return None
+    entry = cache.get(url)
+    body, result = None, 'miss'
+    if entry is not None:
+        if cache.is_fresh(url, entry[1]):
+            body, result = entry[0], 'hit'
+        elif cache.is_stale(url, entry[1]):
+            body, result = entry[0], 'stale'
+            with refreshing_lock:
+                start = url not in refreshing
+                refreshing.add(url)
+            if start:
+                threading.Thread(target=refresh, args=(url,), daemon=True).start()
+    if count:
+        metrics.inc('aurehal_hal_cache_lookups_total', endpoint=endpoint_of(url), result=result)
+    return body
+
+def hal_get(url):
+    """
+    Function to request the HAL API through the responses cache and the HAL client (see hal_client.py).
+
+    Args
+    ----------
+    url (str) : the HAL API url
+
+    Return
+    -------
+    returns the parsed json response
+    """
+    return hal_get_many([url])[0]
+
+def request_many(urls):
+    """Requests concurrently a list of urls to the HAL API without the cache, the requests are counted in the progress of the current harvest"""
+    progress = harvest_progress.get()
+    if progress is not None:
+        progress['requests'] += len(urls)
+    bodies = client.get_many(urls, timeout=request_timeout.get(), deadline=request_deadline.get())
+    for url in urls:
+        logging.info(url)
+    return bodies
+
+def fetch_urls(urls):
+    return {url: json.loads(body) for url, body in zip(urls, request_many(urls))}
+
+def fetch_owned(keys, fetch=fetch_urls):
+    """
+    Fetches the keys claimed by the current thread in the single-flight registry, and publishes the responses to the waiting threads.
+    fetch returns the parsed responses of a list of keys by key. Between processes, the keys are claimed in the responses cache
+    during their request only (see HalCache.claim) : the keys claimed by another process are awaited in the cache, and requested
+    by this thread if their claim ends without a response. No lock is held during the requests, unrelated keys never wait for each other.
+    The responses are shared with the waiting threads, they must not be modified.
+    """
+    fetched = {}
+
+    def fetch_claimed(claimed):
+        try:
+            # another process may have fetched some of them since the first lookup
+            for key in claimed:
+                body = cached(key, count=False)
+                if body is not None:
+                    fetched[key] = json.loads(body)
+            todo = [key for key in claimed if key not in fetched]
+            if todo:
+                for key, resp in fetch(todo).items():
+                    cache.set(key, json.dumps(resp))
+                    fetched[key] = resp
+        finally:
+            cache.release(claimed)
+
+    def await_claims(todo):
+        """Waits for the end of the claims of other processes on some of the keys, returns these keys"""
+        while True:
+            deadline = request_deadline.get()
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError('HAL responses awaited from another process after the deadline')
+            time.sleep(config.CACHE_CLAIM_POLL)
+            done = set(todo) - cache.in_flight(todo)
+            if done:
+                return done
+
+    try:
+        if cache is None:
+            fetched.update(fetch(keys))
+        else:
+            todo = list(keys)
+            while todo:
+                claimed = cache.claim(todo)
+                if claimed:
+                    fetch_claimed(claimed)
+                todo = [key for key in todo if key not in fetched]
+                if todo:
+                    for key in await_claims(todo):
+                        body = cached(key, count=False)
+                        if body is not None:
+                            fetched[key] = json.loads(body)
+                    # the keys released without a response are claimed again
+                    todo = [key for key in todo if key not in fetched]
+    except Exception as e:
+        flights.resolve(keys, error=e)
+        raise
+    flights.resolve(keys, fetched)
+    return fetched
+
+def hal_get_many(urls, fetch=fetch_urls):
+    """
+    Function to request concurrently a list of urls to the HAL API, through the responses cache and the HAL client (see hal_client.py).
+    An url already requested by another thread or process is not requested again, its response is awaited (see singleflight.py).
+
+    Args
+    ----------
+    urls (list) : the HAL API urls
+    fetch (function, default fetch_urls) : returns the parsed responses of the urls missing from the cache by url
+
+    Return
+    -------
+    returns the list of the parsed json responses, in the order of the urls
+    """
+    bodies = [cached(url) for url in urls]
+    missing = list(dict.fromkeys(url for url, body in zip(urls, bodies) if body is None))
+    owned, waiting = flights.claim(missing)
+    fetched = fetch_owned(owned, fetch) if owned else {}
+    for url, future in waiting.items():
+        fetched[url] = future.result()[url]
+    return [json.loads(body) if body is not None else fetched[url] for url, body in zip(urls, bodies)]
+
+def hal_get_by_docid(docids, key_url, fetch_docids):
+    """
+    Function to get a response by structure, through the responses cache and the single-flight registry, while requesting the HAL API in batches.
+    Each structure is keyed by the url of its own query (key_url), so that the responses of a structure reached by several harvests
+    (or several roots of a batch harvest) are shared whatever the batches it was requested in, expire with the TTL of their endpoint
+    and are purged with the structure. Only the structures missing from the cache and not in flight are put in the batches.
+
+    Args
+    ----------
+    docids (list) : the docid HAL structure identifiers (as int)
+    key_url (function) : returns the url of the query of a single structure, whose response is the one cached for the structure
+    fetch_docids (function) : requests a list of structures in batches and returns their parsed responses by docid, as key_url would answer them
+
+    Return
+    -------
+    returns a dict of the parsed json responses by docid
+    """
+    keys = {key_url(docid): docid for docid in docids}
+
+    def fetch(urls):
+        resps = fetch_docids([keys[url] for url in urls])
+        return {url: resps[keys[url]] for url in urls}
+
+    return dict(zip(keys.values(), hal_get_many(list(keys), fetch)))
 
 # -----MAIN FUNCTIONS-------
 
-def render_network_options(hierarchical_enabled=False, direction='UD'):
+def render_network_options(hierarchical_enabled=False, direction='UD', fixed_positions=False):
     DEFAULT_OPTIONS = {
         'height': '700px',
         'width': '100%',
@@ -35,6 +229,11 @@ def render_network_options(hierarchical_enabled=False, direction='UD'):
         # 'edges': {'scaling': {'min': 1, 'max': 5}},
         'physics': {'stabilization': {'iterations': 100}}
     }
+    if fixed_positions:
+        # positions computed by the server (see layout.py) : no physics and no vis.js layout
+        DEFAULT_OPTIONS['layout']['hierarchical']['enabled'] = False
+        DEFAULT_OPTIONS['physics'] = {'enabled': False}
+        DEFAULT_OPTIONS['edges']['smooth'] = False
     return DEFAULT_OPTIONS
 
 def render_network_legend(colors_dict):
@@ -44,14 +243,19 @@ def render_network_legend(colors_dict):
     return ",".join(c_list)
 
 
-def render_datatable(columns, data):
+def render_datatable(columns, data, id=None, custom=False):
+    """DataTable of the structures, paged, sorted and filtered by the browser, or by a callback of the server if custom"""
+    action = "custom" if custom else "native"
     return html.Div([dt.DataTable(
+        **({'id': id} if id is not None else {}),
         columns=columns,
         data=data,
-        sort_action="native",
+        sort_action=action,
         sort_mode="multi",
-        filter_action='native',
-        page_action="native",
+        sort_by=[],
+        filter_action=action,
+        filter_query='',
+        page_action=action,
         page_current=0,
         page_size=10,
         style_header={
@@ -71,25 +275,293 @@ def render_datatable(columns, data):
     ]
     )
 
+def count_url(id):
+    """Url of the number of publications of a structure, the one its count is cached under"""
+    return config.HAL_API_URL + 'search/?wt=json&q=authStructId_i:{}&rows=0'.format(id)
+
 def get_nb_pub_by_struct(id):
     numfound = ""
-    url = 'https://api.archives-ouvertes.fr/search/?wt=json&q=authStructId_i:{}&rows=1'.format(id)
-    resp = requests.get(url).text
-    if json.loads(resp)['response']:
-        numfound = json.loads(resp)['response']['numFound']
+    resp = hal_get(count_url(id))
+    if resp['response']:
+        numfound = resp['response']['numFound']
     else:
         pass
     return numfound
 
-def get_child_struct(id, result=None):
+def chunks(lst, n):
+    """Yield successive n-sized chunks from lst."""
+    lst = list(lst)
+    for i in range(0, len(lst), n):
+        yield lst[i:i + n]
+
+# max number of docids in a single "field:(a OR b OR ...)" query, keeps the url well under the usual 8k limit
+OR_QUERY_CHUNK_SIZE = 200
+# max number of facet.query params (one per docid) in a single search request
+FACET_QUERY_CHUNK_SIZE = 100
+# max rows per page of the ref/structure API
+REF_ROWS = 10000
+
+def fetch_counts(docid_list):
+    """Requests the publications counts of structures in faceted requests, returns the responses by docid as count_url answers them"""
+    urls = [config.HAL_API_URL + 'search/?wt=json&q=authStructId_i:({})&rows=0&facet=true&{}'.format(
+        ' OR '.join([str(i) for i in chunk]), '&'.join(['facet.query=authStructId_i:{}'.format(i) for i in chunk]))
+        for chunk in chunks(docid_list, FACET_QUERY_CHUNK_SIZE)]
+    counts = {}
+    for body in request_many(urls):
+        for key, value in json.loads(body).get('facet_counts', {}).get('facet_queries', {}).items():
+            counts[int(key.split(':')[1])] = value
+    resps = {docid: {'response': {'numFound': counts[docid], 'start': 0, 'docs': []}} for docid in docid_list if docid in counts}
+    missing = [docid for docid in docid_list if docid not in counts]
+    resps.update(zip(missing, [json.loads(body) for body in request_many([count_url(docid) for docid in missing])] if missing else []))
+    return resps
+
+def get_nb_pub_by_structs(docid_list):
+    """
+    Function to get the number of publications of a list of structures in a few concurrent requests.
+    Counts are coming from faceted requests to the search HAL API (param &rows=0) with one facet.query per structure on the authStructId_i field,
+    FACET_QUERY_CHUNK_SIZE structures by request. The docids missing from the facets output fall back to a request by structure.
+    The counts are cached by structure (see hal_get_by_docid), only the structures missing from the cache are put in the faceted requests.
+
+    Args
+    ----------
+    docid_list (list) : a list of docid HAL structure's identifiers
+
+    Return
+    -------
+    returns a dict of publications counts by docid (as int)
+    Example : {1039632: 61234, 520677: 312}
+    """
+    counts = {}
+    for docid, resp in hal_get_by_docid([int(i) for i in docid_list], count_url, fetch_counts).items():
+        counts[docid] = resp['response']['numFound'] if resp['response'] else ""
+    return counts
+
+CHILDREN_URL = config.HAL_API_URL + 'ref/structure/?wt=json&rows={}&start={}&q=parentDocid_i:({})&fl=docid,parentDocid_i&sort=docid asc'
+
+def children_url(id, start=0):
+    """Url of a page of the children of a structure, the first one is the one its children are cached under"""
+    return CHILDREN_URL.format(REF_ROWS, start, id)
+
+def fetch_children(parent_ids):
+    """
+    Requests the children of structures in parentDocid_i:(a OR b OR ...) queries, run concurrently and paged until all the docs are retrieved,
+    returns the responses by docid as children_url answers them
+    """
+    queries = [' OR '.join([str(i) for i in chunk]) for chunk in chunks(parent_ids, OR_QUERY_CHUNK_SIZE)]
+    # first pages of all the chunks, then the next pages of the chunks with more than REF_ROWS children
+    docs = []
+    next_pages = []
+    for query, body in zip(queries, request_many([CHILDREN_URL.format(REF_ROWS, 0, query) for query in queries])):
+        resp = json.loads(body)
+        docs.extend(resp['response']['docs'])
+        next_pages.extend([CHILDREN_URL.format(REF_ROWS, start, query) for start in range(REF_ROWS, resp['response']['numFound'], REF_ROWS)])
+    for body in (request_many(next_pages) if next_pages else []):
+        docs.extend(json.loads(body)['response']['docs'])
+    children = {docid: [] for docid in parent_ids}
+    for doc in docs:
+        for parent in doc.get('parentDocid_i', []):
+            if int(parent) in children:
+                children[int(parent)].append(doc)
+    # the leaves, most of the structures of a level, share the same (unmodified) response
+    empty = {'response': {'numFound': 0, 'start': 0, 'docs': []}}
+    return {docid: {'response': {'numFound': len(found), 'start': 0, 'docs': found[:REF_ROWS]}} if found else empty for docid, found in children.items()}
+
+def get_child_docs(parent_ids):
+    """
+    Function to get in a few batched requests all the direct child structures of a list of structures.
+    If a local snapshot of the referential is available (see snapshot.py) the children are read from its adjacency index without any request.
+    Otherwise the children are cached by structure (see hal_get_by_docid), and the structures missing from the cache are grouped
+    in parentDocid_i:(a OR b OR ...) queries (see fetch_children).
+
+    Args
+    ----------
+    parent_ids (list) : a list of docid HAL structure's identifiers
+
+    Return
+    -------
+    returns a list of dicts with docid and parentDocid_i keys
+    Example : [{'docid': 520677, 'parentDocid_i': [1039632]},...]
+    """
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        children = set(c for _, children in snapshot.neighbours('children', parent_ids) for c in children)
+        return snapshot.docs(sorted(children), ['parentDocid_i'])
+    docs = {}
+    # the structures with more than REF_ROWS children get their next pages
+    next_pages = []
+    for docid, resp in hal_get_by_docid([int(i) for i in parent_ids], children_url, fetch_children).items():
+        docs.update((doc['docid'], doc) for doc in resp['response']['docs'])
+        next_pages.extend([children_url(docid, start) for start in range(REF_ROWS, resp['response']['numFound'], REF_ROWS)])
+    for resp in hal_get_many(next_pages):
+        docs.update((doc['docid'], doc) for doc in resp['response']['docs'])
+    return [docs[docid] for docid in sorted(docs)]
+
+def find_cycle(edges):
+    """
+    Returns the nodes involved in a cycle of a list of (from, to) edges (empty set for a DAG).
+    Uses Kahn's algorithm : the nodes which can't be topologically sorted are on a cycle or downstream of one.
+    """
+    indegree = {}
+    successors = {}
+    for parent, child in edges:
+        successors.setdefault(parent, []).append(child)
+        indegree[child] = indegree.get(child, 0) + 1
+        indegree.setdefault(parent, 0)
+    queue = [node for node, degree in indegree.items() if degree == 0]
+    while queue:
+        node = queue.pop()
+        for child in successors.get(node, []):
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                queue.append(child)
+    return set(node for node, degree in indegree.items() if degree > 0)
+
+
+def child_links(level):
+    """Returns the (parent, child) links between the structures of a level and their children"""
+    links = []
+    parents = set(level)
+    for node in get_child_docs(level):
+        for parent in node.get('parentDocid_i', []):
+            if int(parent) in parents:
+                links.append((int(parent), node['docid']))
+    return links
+
+
+def parent_links(level):
+    """Returns the (child, parent) links between the structures of a level and their parents"""
+    links = []
+    for node in get_structs_docs(level, ['parentDocid_i']):
+        for parent in node.get('parentDocid_i', []):
+            links.append((int(node['docid']), int(parent)))
+    return links
+
+
+class HarvestResult(list):
+    """
+    List of the harvested edges, with the structures reached and not (or partially) expanded (frontier) when the walk has been stopped before its end,
+    and the truncated flag when it has been stopped by its time or nodes budget
+    """
+    frontier = []
+    truncated = False
+
+
+def traverse(id, direction, result=None, on_level=None, cancelled=None, max_depth=None, deadline=None, max_nodes=None, timeout=None):
+    """
+    Function to walk the Aurehal graph from a structure, level by level, in the descending (children) or ascending (parents) direction.
+    Each structure is expanded only once thanks to a visited set, so shared ancestors or descendants (structures with several parents) are not walked again,
+    and an edge can only be found again in the level of its structure. Only the visited ids are kept during the walk, the edges are passed to result.
+    A cycle in the referential can't loop the walk, it is reported in the logs after the walk from the edges of result (none if result doesn't keep them).
+
+    Args
+    ----------
+    id (str|int) : the docid HAL structure identifier
+    direction (str) : "desc" for the child structures, "asc" for the parent structures
+    result (list of dicts, default None) : the cumulative list of dictionaries in which the edges are incremented
+    on_level (function, default None) : called after each level with the new edges and the new structures ids of the level
+    cancelled (function, default None) : checked before each level, the walk stops if it returns True
+    max_depth (int, default None) : the number of levels to walk, all of them by default
+    deadline (float, default None) : the time budget of the walk in seconds, the walk stops at the first level started after it
+                                     or at the level whose requests (or on_level, the metadata of the structures) fail after it
+    max_nodes (int, default None) : the maximum number of structures of the walk, the neighbours found beyond it are left out
+    timeout (float, default None) : the timeout of each request to the HAL API in seconds (config.HAL_TIMEOUT by default), limited to the time left before the deadline.
+                                    The timeout and the deadline hold for all the requests of the walk, the ones of on_level included, the ones set by the caller by default
+
+    Return
+    -------
+    returns a list of dicts populated with HAL docid (of structures) and "from" and "to" keys,
+    a HarvestResult with the frontier of the walk and the truncated flag if no intermediate result was given
+    """
+    if result is None:  # create a new result if no intermediate was given
+        result = HarvestResult()
+    root = int(id)
+    # keep the ids formats of the original recursive functions : root as given, children as int and parents as str
+    def as_id(docid):
+        if docid == root:
+            return id
+        return docid if direction == "desc" else str(docid)
+    links = child_links if direction == "desc" else parent_links
+    visited = {root}
+    level = [root]
+    depth = 0
+    end = time.monotonic() + deadline if deadline is not None else None
+    truncated = False
+    # structures of the last expanded level with neighbours left out by the nodes budget
+    partial = []
+    tokens = (request_timeout.set(timeout if timeout is not None else request_timeout.get()),
+              request_deadline.set(end if end is not None else request_deadline.get()))
+    try:
+        while level and ((max_depth is None) or (depth < max_depth)):
+            if (cancelled is not None) and cancelled():
+                break
+            if (end is not None) and (time.monotonic() >= end):
+                truncated = True
+                break
+            depth += 1
+            next_level = []
+            new_edges = []
+            level_edges = set()
+            try:
+                level_links = links(level)
+            except Exception:
+                if (end is not None) and (time.monotonic() >= end):
+                    logging.warning('harvest of {} stopped by its deadline'.format(id))
+                    truncated = True
+                    break
+                raise
+            for node, neighbour in level_links:
+                if (neighbour not in visited) and (max_nodes is not None) and (len(visited) >= max_nodes):
+                    truncated = True
+                    partial.append(node)
+                    continue
+                edge = (node, neighbour) if direction == "desc" else (neighbour, node)
+                if edge not in level_edges:
+                    level_edges.add(edge)
+                    new_edges.append({"from": as_id(edge[0]), 'to': as_id(edge[1])})
+                if neighbour not in visited:
+                    visited.add(neighbour)
+                    next_level.append(neighbour)
+            if on_level is not None:
+                try:
+                    on_level(new_edges, [as_id(i) for i in next_level])
+                except Exception:
+                    # the level is left out, its structures stay in the frontier
+                    if (end is not None) and (time.monotonic() >= end):
+                        logging.warning('harvest of {} stopped by its deadline'.format(id))
+                        truncated = True
+                        partial = []
+                        break
+                    raise
+            result.extend(new_edges)
+            level = next_level
+            if partial:
+                break
+    finally:
+        request_timeout.reset(tokens[0])
+        request_deadline.reset(tokens[1])
+    if isinstance(result, HarvestResult):
+        result.frontier = [as_id(i) for i in dict.fromkeys(partial + level)]
+        result.truncated = truncated
+    cycle = find_cycle((int(e['from']), int(e['to'])) for e in result)
+    if cycle:
+        logging.warning('cycle in the Aurehal graph of {} : {}'.format(id, sorted(cycle)))
+    return result
+
+
+def get_child_struct(id, result=None, max_depth=None, deadline=None, max_nodes=None, timeout=None):
     """
-    Function to recursivly get all the child structures of a structure in the Aurehal referential.
-    Metadata are coming from a request on the parentDocid_id field to the ref/structure HAL API (param &q=parentDocid_i:).
+    Function to get all the child structures of a structure in the Aurehal referential.
+    The tree is harvested level by level : all the structures of a level are expanded together with batched requests on the parentDocid_i field to the ref/structure HAL API (param &q=parentDocid_i:(a OR b OR ...)),
+    so the number of requests grows with the depth of the tree and not with its number of nodes.
 
     Args
     ----------
     id (str|int) : the docid HAL structure identifier
     result (list of dicts, default None) : the cumulative list of dictionaries in which the parsed data are incremented
+    max_depth (int, default None) : the number of levels of children to harvest, all of them by default
+    deadline (float, default None) : the time budget of the harvest in seconds
+    max_nodes (int, default None) : the maximum number of structures of the harvest
+    timeout (float, default None) : the timeout of each request to the HAL API in seconds
 
     Return
     -------
@@ -101,22 +573,7 @@ def get_child_struct(id, result=None):
     * get_childStruct(id,None)
     * Assign to a dataframe : df = pd.DataFrame(get_childStruct(id,None))
     """
-    if result is None:  # create a new result if no intermediate was given
-        result = []
-    url = 'https://api.archives-ouvertes.fr/ref/structure/?wt=json&rows=10000&q=parentDocid_i:{}&fl=docid'.format(
-        id)
-    print(url)
-    resp = requests.get(url).text
-    if len(json.loads(resp)['response']['docs']) != 0:
-        data = json.loads(resp)['response']['docs']
-        for node in data:
-            result.append({"from": id, 'to': node['docid']})
-            get_child_struct(node['docid'], result)
-    else:
-        pass
-    # dedup in case of duplicate relatioships
-    output = [i for n, i in enumerate(result) if i not in result[n + 1:]]
-    return output
+    return traverse(id, "desc", result, max_depth=max_depth, deadline=deadline, max_nodes=max_nodes, timeout=timeout)
 
 def dict_populate(node,id=None,result=None):
     result.append({"from": node, 'to': id})
@@ -124,15 +581,19 @@ def dict_populate(node,id=None,result=None):
 
 
 
-def get_parent_struct(id, result=None):
+def get_parent_struct(id, result=None, max_depth=None, deadline=None, max_nodes=None, timeout=None):
     """
-    Function to recursivly get all the parent structures of a structure in the Aurehal referential.
-    Metadata are coming from a request on the docid field to the ref/structure HAL API (param &q=docid:) and with the parentDocid_i in the result displayed fields (param &fl=parentDocid_i).
+    Function to get all the parent structures of a structure in the Aurehal referential.
+    The ancestors are harvested level by level with batched requests on the docid field to the ref/structure HAL API (param &q=docid:(a OR b OR ...)) and with the parentDocid_i in the result displayed fields (param &fl=parentDocid_i).
 
     Args
     ----------
     id (str|int) : the docid HAL structure identifier
     result (list of dicts, default None) : the cumulative list of dictionaries in which the parsed data are incremented
+    max_depth (int, default None) : the number of levels of parents to harvest, all of them by default
+    deadline (float, default None) : the time budget of the harvest in seconds
+    max_nodes (int, default None) : the maximum number of structures of the harvest
+    timeout (float, default None) : the timeout of each request to the HAL API in seconds
 
     Return
     -------
@@ -144,21 +605,39 @@ def get_parent_struct(id, result=None):
     * get_parentStruct(id,None)
     * Assign to a dataframe : df = pd.DataFrame(get_parentStruct(id,None))
     """
-    if result is None:  # create a new result if no intermediate was given
-        result = []
-    url = 'https://api.archives-ouvertes.fr/ref/structure/?wt=json&rows=50&q=docid:"{}"&fl=parentDocid_i'.format(
-        id)
-    print(url)
-    resp = requests.get(url).text
-    if json.loads(resp)['response']['docs'][0]:
-        data = json.loads(resp)['response']['docs'][0]['parentDocid_i']
-        for node in data:
-            result.append({"from": node, 'to': id})
-            get_parent_struct(node, result)
+    return traverse(id, "asc", result, max_depth=max_depth, deadline=deadline, max_nodes=max_nodes, timeout=timeout)
+
+
+def parse_struct_infos(id, item):
+    """
+    Function to shape the ref/structure doc of a structure into the dict used to build the nodes dataframe.
+    idref_s is flattened to its first value, and the dot/no_dot keys give the vis.js node shape depending on the presence of an Idref ppn.
+
+    Args
+    ----------
+    id (str|int) : the docid HAL structure identifier
+    item (dict) : the doc returned by the ref/structure HAL API for this structure
+
+    Return
+    -------
+    returns a dict populated with the HAL requested metadata
+    """
+    result = {}
+    result["id"] = id
+    if 'idref_s' in item.keys():
+        for key, value in item.items():
+            if key == "idref_s":
+                result[key] = value[0]
+            else:
+                result[key] = value
+            result["no_dot"] = "image"
+            result["dot"] = "dot"
     else:
-        pass
-    output = [i for n, i in enumerate(result) if i not in result[n + 1:]]
-    return output
+        for key, value in item.items():
+            result[key] = value
+            result["no_dot"] = "dot"
+            result["dot"] = "dot"
+    return result
 
 
 def get_struct_infos(id):
@@ -179,36 +658,66 @@ def get_struct_infos(id):
     Uses
     -------
     * get_struct_infos(id)
-    * used in the get_list_struct_infos function
     """
     result = {}
-    url = 'https://api.archives-ouvertes.fr/ref/structure/?wt=json&q=docid:{}&fl=acronym_s,label_s,valid_s,type_s,idref_s,address_s,url_s'.format(
+    url = config.HAL_API_URL + 'ref/structure/?wt=json&q=docid:{}&fl=acronym_s,label_s,valid_s,type_s,idref_s,address_s,url_s'.format(
         id)
-    print(url)
-    resp = requests.get(url).text
-    data = json.loads(resp)['response']['docs']
+    data = hal_get(url)['response']['docs']
     result["id"] = id
     result["nb_publis"] = get_nb_pub_by_struct(id)
     for item in data:
-        if 'idref_s' in item.keys():
-            for key, value in item.items():
-                if key == "idref_s":
-                    result[key] = value[0]     
-                else:              
-                    result[key] = value
-                result["no_dot"] = "image"
-                result["dot"] = "dot"             
-        else:
-            for key, value in item.items():
-                result[key] = value
-                result["no_dot"] = "dot"
-                result["dot"] = "dot"  
+        result.update(parse_struct_infos(id, item))
     return result
 
 
+STRUCT_FIELDS = META_FIELDS
+
+def get_structs_docs(docid_list, fl=STRUCT_FIELDS):
+    """
+    Function to get in a few concurrent requests the descriptive HAL metadata of a list of structures.
+    Metadata are coming from the local snapshot of the referential if any (see snapshot.py), else from requests on the docid field to the ref/structure HAL API (&q=docid:(a OR b OR ...)), OR_QUERY_CHUNK_SIZE structures by request.
+
+    Args
+    ----------
+    docid_list (list) : a list of docid HAL structure's identifiers
+    fl (list, default STRUCT_FIELDS) : the fields to return
+
+    Return
+    -------
+    returns a list of the docs returned by the API, with the docid key
+    """
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        docs = snapshot.docs(docid_list, fl)
+        found = set(doc['docid'] for doc in docs)
+        missing = [i for i in docid_list if int(i) not in found]
+        # structures created since the snapshot are requested to the API
+        return docs + (get_structs_docs_online(missing, fl) if missing else [])
+    return get_structs_docs_online(docid_list, fl)
+
+
+def get_structs_docs_online(docid_list, fl=STRUCT_FIELDS):
+    """
+    Same as get_structs_docs, always requesting the ref/structure HAL API.
+    The docs are cached by structure (see hal_get_by_docid), only the structures missing from the cache are put in the docid:(a OR b OR ...) queries.
+    """
+    url = config.HAL_API_URL + 'ref/structure/?wt=json&rows={}&q=docid:({})&fl=docid,{}'
+
+    def fetch_docs(docids):
+        urls = [url.format(len(chunk), ' OR '.join([str(i) for i in chunk]), ','.join(fl)) for chunk in chunks(docids, OR_QUERY_CHUNK_SIZE)]
+        found = {doc['docid']: doc for body in request_many(urls) for doc in json.loads(body)['response']['docs']}
+        return {docid: {'response': {'numFound': int(docid in found), 'start': 0, 'docs': [found[docid]] if docid in found else []}}
+                for docid in docids}
+
+    resps = hal_get_by_docid([int(i) for i in docid_list], lambda docid: url.format(1, docid, ','.join(fl)), fetch_docs)
+    return [doc for resp in resps.values() for doc in resp['response']['docs']]
+
+
 def get_list_struct_infos(docid_list):
     """
-    applies the get_struct_infos function to a list of structure's docid and compile the results in a dataframe.
+    Function to get the descriptive HAL metadata of a list of structures and compile the results in a dataframe.
+    The docids are grouped by OR_QUERY_CHUNK_SIZE in docid:(a OR b OR ...) queries that are run concurrently, so a graph of 1500 structures costs a handful of requests.
+    The publications counts are taken in the same way from faceted search requests (see get_nb_pub_by_structs).
 
     Args
     ----------
@@ -217,23 +726,25 @@ def get_list_struct_infos(docid_list):
 
     Return
     -------
-    returns a dataframe populated with all the results of teh get_struct_infos function
+    returns a dataframe populated with the same columns as the get_struct_infos function
 
     Uses
     -------
     * get_list_struct_infos(docid_list)
     * assign to a new dataframe : df = get_list_struct_infos(docid_list)
     """
-    processes = []
+    # keep the docids as given so that the nodes ids match the edges ones
+    ids = {int(i): i for i in docid_list}
+    docs = {}
+    # the docs may be shared with other threads (see fetch_owned), they are not modified
+    for item in get_structs_docs(list(ids.keys())):
+        docs[item['docid']] = {key: value for key, value in item.items() if key != 'docid'}
+    nb_publis = get_nb_pub_by_structs(list(ids.keys()))
     df_collection = []
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        processes = {executor.submit(get_struct_infos, i): i for i in docid_list}
-    for task in as_completed(processes):
-        worker_result = task.result()
-        df_collection.append(worker_result)
-    results =  pd.DataFrame(df_collection)
-    #results = pd.DataFrame()
-    #for i in docid_list:
-    #    df = pd.DataFrame(get_struct_infos(i), index=[i])
-    #    results = pd.concat([results, df], axis=0).reset_index(drop=True)
+    for docid, id in ids.items():
+        result = {"id": id, "nb_publis": nb_publis[docid]}
+        if docid in docs:
+            result.update(parse_struct_infos(id, docs[docid]))
+        df_collection.append(result)
+    results = pd.DataFrame(df_collection)
     return results
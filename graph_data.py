@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from snapshot import META_FIELDS
+from layout import longest_path_levels
+
+# -----COMPACT HARVESTED GRAPH-------
+# Container of a harvested graph, stored in the graph store (see graph_store.py) and read by the callbacks of the app :
+# * the structures in a typed dataframe : int64 docids (the harvest gives str or int ids depending on the direction and the root),
+#   int32 publications counts, categorical valid_s and type_s, and has_idref instead of the dot/no_dot shape strings
+# * the edges as two int32 arrays of rows of the structures dataframe (parent -> child)
+# * the frontier of the harvest as docids, and its search index (see search_index.py)
+# A new level or an expanded structure gives a new graph (add), the previous one stays valid for the callbacks still reading it.
+# The render attributes computed by the app are kept in the cache dict, which is not pickled, as well as the rollups of the graph (see subtree_rollups).
+
+CATEGORIES = ['valid_s', 'type_s']
+NODE_COLUMNS = ['id', 'nb_publis'] + META_FIELDS + ['has_idref']
+
+
+def typed_nodes(node_df):
+    """Typed dataframe (NODE_COLUMNS) of the structures returned by get_list_struct_infos"""
+    node_df = node_df if node_df is not None else pd.DataFrame(columns=['id'])
+    df = pd.DataFrame({'id': pd.to_numeric(node_df['id']).astype('int64')}, index=pd.RangeIndex(len(node_df)))
+    def column(name):
+        return node_df[name].values if name in node_df.columns else None
+    # the publications counts can be missing or ""
+    df['nb_publis'] = pd.to_numeric(pd.Series(column('nb_publis'), index=df.index, dtype=object), errors='coerce').fillna(0).astype('int32')
+    for field in META_FIELDS:
+        df[field] = pd.Series(column(field), index=df.index, dtype=object).astype('category') if field in CATEGORIES else column(field)
+    df['has_idref'] = df['idref_s'].notna()
+    return df[NODE_COLUMNS]
+
+
+def concat_nodes(frames):
+    """Concatenation of typed dataframes, the categories are merged instead of falling back to object columns"""
+    frames = [df for df in frames if len(df)] or frames[:1]
+    df = pd.concat(frames, ignore_index=True)
+    for field in CATEGORIES:
+        df[field] = union_categoricals([frame[field] for frame in frames])
+    return df
+
+
+def subtree_rollups(n, src, dst, weights):
+    """
+    Function to compute in one pass over the graph, from the deepest structures up, the statistics of the structures under each one :
+    its number of distinct descendants, its height (number of levels under it) and the sum of the weights (publications counts) of itself
+    and its distinct descendants. A structure reached by several paths (several parents) is counted once.
+    The descendants sets are bitsets (python ints) over a depth-first numbering of the structures, so that the set of a subtree is a compact
+    range of bits stored from its lowest bit, and the set of a structure is dropped once all its parents have been computed.
+    The edges of a cycle going back up in the levels are left out.
+
+    Args
+    ----------
+    n (int) : the number of structures
+    src, dst (arrays) : the rows of the parent and child structures of the edges
+    weights (array) : the weight of each structure
+
+    Return
+    -------
+    returns the descendants, height and summed weights arrays
+    """
+    levels, parents, children = longest_path_levels(n, zip(src.tolist(), dst.tolist()))
+    levels = levels.tolist()
+    children = [[c for c in dict.fromkeys(cs) if levels[c] > levels[v]] for v, cs in enumerate(children)]
+    # depth-first numbering from the roots
+    number = [-1] * n
+    count = 0
+    for root in sorted(range(n), key=lambda v: levels[v]):
+        if number[root] >= 0:
+            continue
+        stack = [root]
+        while stack:
+            v = stack.pop()
+            if number[v] >= 0:
+                continue
+            number[v] = count
+            count += 1
+            stack.extend(reversed([c for c in children[v] if number[c] < 0]))
+    weights = np.asarray(weights, dtype=np.int64)
+    by_number = np.zeros(n, dtype=np.int64)
+    by_number[number] = weights
+    waiting = [0] * n
+    for cs in children:
+        for c in cs:
+            waiting[c] += 1
+    # row -> (lowest number, bitset of the structure and its descendants from this number)
+    sets = {}
+    descendants = np.zeros(n, dtype=np.int64)
+    height = np.zeros(n, dtype=np.int64)
+    total = weights.copy()
+    for v in sorted(range(n), key=lambda v: -levels[v]):
+        low, bits = number[v], 1
+        for c in children[v]:
+            c_low, c_bits = sets[c]
+            if c_low < low:
+                bits, low = bits << (low - c_low), c_low
+            bits |= c_bits << (c_low - low)
+            height[v] = max(height[v], height[c] + 1)
+            waiting[c] -= 1
+            if not waiting[c]:
+                del sets[c]
+        if children[v]:
+            flags = np.unpackbits(np.frombuffer(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'), dtype=np.uint8), bitorder='little')
+            flags = flags[:n - low].astype(bool)
+            descendants[v] = flags.sum() - 1
+            total[v] = by_number[low:low + len(flags)][flags].sum()
+        if waiting[v]:
+            sets[v] = (low, bits)
+    return descendants, height, total
+
+
+class HarvestGraph:
+
+    def __init__(self, nodes=None, src=None, dst=None, frontier=None, index=None):
+        self.nodes = nodes if nodes is not None else typed_nodes(None)
+        self.src = src if src is not None else np.zeros(0, dtype=np.int32)
+        self.dst = dst if dst is not None else np.zeros(0, dtype=np.int32)
+        self.frontier = frontier if frontier is not None else np.zeros(0, dtype=np.int64)
+        self.index = index
+        self.cache = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __getstate__(self):
+        return {key: value for key, value in self.__dict__.items() if key != 'cache'}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, cache={})
+
+    @property
+    def ids(self):
+        return self.nodes['id'].values
+
+    def rows(self, docids):
+        """Rows of the structures of a list of docids (str or int), -1 for the unknown ones"""
+        if 'rows' not in self.cache:
+            self.cache['rows'] = pd.Index(self.ids)
+        return self.cache['rows'].get_indexer(pd.to_numeric(pd.Series(docids, dtype=object)).astype('int64'))
+
+    def rollups(self):
+        """Dataframe of the statistics of the structures under each structure (see subtree_rollups), computed once per graph"""
+        if 'rollups' not in self.cache:
+            descendants, height, total = subtree_rollups(len(self), self.src, self.dst, self.nodes['nb_publis'].values)
+            self.cache['rollups'] = pd.DataFrame({'descendants': descendants, 'height': height, 'nb_publis_total': total}, index=self.nodes.index)
+        return self.cache['rollups']
+
+    def edge_frame(self):
+        """Dataframe of the edges with the docids of the structures, "from" and "to" columns"""
+        return pd.DataFrame({'from': self.ids[self.src], 'to': self.ids[self.dst]})
+
+    def add(self, node_df, edges, frontier=None):
+        """
+        Returns a new graph with new structures and edges, the edges whose structures are not in the graph are left out.
+        The search index, shared with the previous graph, gets them too.
+
+        Args
+        ----------
+        node_df (dataframe|None) : the new structures, as returned by get_list_struct_infos or typed_nodes
+        edges (list of dicts) : the new edges, with "from" and "to" keys (docids as str or int)
+        frontier (list, default None) : the new frontier of the graph, the current one by default
+        """
+        graph = HarvestGraph(self.nodes, self.src, self.dst, self.frontier if frontier is None else np.array(frontier, dtype=np.int64), self.index)
+        if (node_df is not None) and len(node_df):
+            new_nodes = node_df if list(node_df.columns) == NODE_COLUMNS else typed_nodes(node_df)
+            graph.nodes = concat_nodes([self.nodes, new_nodes])
+        if edges:
+            src = graph.rows([e['from'] for e in edges])
+            dst = graph.rows([e['to'] for e in edges])
+            known = (src >= 0) & (dst >= 0)
+            graph.src = np.concatenate([self.src, src[known].astype(np.int32)])
+            graph.dst = np.concatenate([self.dst, dst[known].astype(np.int32)])
+        if (self.index is not None) and ((len(graph.nodes) > len(self.nodes)) or (len(graph.src) > len(self.src))):
+            self.index.add(graph.nodes.iloc[len(self.nodes):] if len(graph.nodes) > len(self.nodes) else None,
+                           [{'from': f, 'to': t} for f, t in zip(graph.ids[graph.src[len(self.src):]], graph.ids[graph.dst[len(self.dst):]])])
+        return graph
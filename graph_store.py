@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import time
+import pickle
+import threading
+from collections import OrderedDict
+import config
+
+# -----SERVER-SIDE GRAPH STORE-------
+# The harvested graphs are kept server-side, keyed by a graph id, and only the id goes to the browser.
+# A graph is pickled in config.GRAPHS_DIR (shared by the gunicorn workers) and the last used ones are kept in memory (LRU of config.GRAPHS_MEMORY graphs).
+
+# the graph ids come back from the browser (dcc.Store) : only uuid4 hex ids (the job ids, see jobs.py) can name a pickle to load
+GRAPH_ID = re.compile('[0-9a-f]{32}')
+
+
+class GraphStore:
+
+    def __init__(self, path=config.GRAPHS_DIR, memory=config.GRAPHS_MEMORY, ttl=config.GRAPHS_TTL):
+        self.path = path
+        self.memory = memory
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # graph id -> (file mtime, graph)
+        self.graphs = OrderedDict()
+
+    def file(self, graph_id):
+        if not (isinstance(graph_id, str) and GRAPH_ID.fullmatch(graph_id)):
+            raise ValueError('invalid graph id {!r}'.format(graph_id))
+        return os.path.join(self.path, '{}.pkl'.format(graph_id))
+
+    def put(self, graph_id, graph):
+        """Stores a graph (a HarvestGraph, see graph_data.py)"""
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self.file(graph_id) + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(graph, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self.file(graph_id))
+        with self.lock:
+            self.graphs[graph_id] = (os.path.getmtime(self.file(graph_id)), graph)
+            self.graphs.move_to_end(graph_id)
+            while len(self.graphs) > self.memory:
+                self.graphs.popitem(last=False)
+
+    def get(self, graph_id):
+        """Returns a graph or None, the memory copy is reloaded if another worker has updated the graph"""
+        try:
+            mtime = os.path.getmtime(self.file(graph_id))
+        except (FileNotFoundError, ValueError):
+            return None
+        with self.lock:
+            if (graph_id in self.graphs) and (self.graphs[graph_id][0] == mtime):
+                self.graphs.move_to_end(graph_id)
+                return self.graphs[graph_id][1]
+        with open(self.file(graph_id), 'rb') as f:
+            graph = pickle.load(f)
+        with self.lock:
+            self.graphs[graph_id] = (mtime, graph)
+            self.graphs.move_to_end(graph_id)
+            while len(self.graphs) > self.memory:
+                self.graphs.popitem(last=False)
+        return graph
+
+    def cleanup(self):
+        """Deletes the graphs older than ttl"""
+        if not os.path.exists(self.path):
+            return
+        limit = time.time() - self.ttl
+        for name in os.listdir(self.path):
+            try:
+                if os.path.getmtime(os.path.join(self.path, name)) < limit:
+                    os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+
+
+store = GraphStore()
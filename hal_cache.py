@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import re
+from urllib.parse import urlparse, parse_qs
+import config
+
+# -----HAL RESPONSES CACHE-------
+# On-disk cache (SQLite) of the HAL API responses, shared by all the gunicorn workers and kept across restarts.
+# Each entry is stamped with the docids found in its query so that all the responses about a structure can be purged at once.
+# The urls being requested are claimed in the inflight table, so that a process doesn't request again an url requested by another one
+# but waits for its response in the cache (see fetch_owned in functions.py).
+
+
+def endpoint_of(url):
+    """Returns the HAL endpoint of an url : 'ref/structure' or 'search'"""
+    path = urlparse(url).path
+    if 'ref/structure' in path:
+        return 'ref/structure'
+    return 'search'
+
+
+def docids_of(url):
+    """Returns the docids found in the q and facet.query params of an url"""
+    params = parse_qs(urlparse(url).query)
+    values = params.get('q', []) + params.get('facet.query', [])
+    return set(re.findall(r'\d+', ' '.join(values)))
+
+
+def owner_id():
+    """Id of the calling thread in the claims of the urls being requested"""
+    return '{}:{}'.format(os.getpid(), threading.get_ident())
+
+
+class HalCache:
+    """
+    SQLite store of the HAL API responses, with per-endpoint TTLs (config.CACHE_TTL), a stale-while-revalidate window (config.CACHE_STALE)
+    and a least recently used eviction when the stored responses exceed config.CACHE_MAX_BYTES.
+    """
+
+    def __init__(self, path=config.CACHE_PATH, max_bytes=config.CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.writes = 0
+        self.conn().execute("""CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY, endpoint TEXT, docids TEXT, body BLOB, size INTEGER, created REAL, accessed REAL)""")
+        self.conn().execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn().execute("CREATE TABLE IF NOT EXISTS inflight (url TEXT PRIMARY KEY, owner TEXT, expires REAL)")
+
+    def conn(self):
+        # one connection per thread, sqlite connections can't be shared between threads
+        if getattr(self.local, 'conn', None) is None:
+            self.local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.local.conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn.execute("PRAGMA synchronous=NORMAL")
+        return self.local.conn
+
+    def get(self, url):
+        """Returns (body, age in seconds) of a cached response or None"""
+        row = self.conn().execute("SELECT body, created FROM responses WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        self.conn().execute("UPDATE responses SET accessed = ? WHERE url = ?", (now, url))
+        return zlib.decompress(row[0]).decode('utf-8'), now - row[1]
+
+    def set(self, url, body):
+        data = zlib.compress(body.encode('utf-8'))
+        now = time.time()
+        self.conn().execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (url, endpoint_of(url), ',{},'.format(','.join(sorted(docids_of(url)))), data, len(data), now, now))
+        self.writes += 1
+        if self.writes % 100 == 0:
+            self.evict()
+
+    def evict(self):
+        """Deletes the least recently used responses until the cache fits in max_bytes"""
+        total = self.conn().execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        urls = []
+        for url, size in self.conn().execute("SELECT url, size FROM responses ORDER BY accessed"):
+            urls.append((url,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.conn().executemany("DELETE FROM responses WHERE url = ?", urls)
+
+    def is_fresh(self, url, age):
+        return age < config.CACHE_TTL[endpoint_of(url)]
+
+    def is_stale(self, url, age):
+        """True if the response is expired but can still be served while it is refreshed"""
+        return age < config.CACHE_TTL[endpoint_of(url)] + config.CACHE_STALE
+
+    def purge_docid(self, docid):
+        """Deletes all the cached responses of the queries involving the docid, returns the number of deleted responses"""
+        cursor = self.conn().execute("DELETE FROM responses WHERE docids LIKE ?", ('%,{},%'.format(int(docid)),))
+        return cursor.rowcount
+
+    def claim(self, urls, lease=config.CACHE_CLAIM_LEASE):
+        """
+        Claims the request of the urls for the calling thread during lease seconds, returns the claimed urls :
+        the urls claimed by another thread or process are left to it, unless their claim has expired (dead process)
+        """
+        now = time.time()
+        owner = owner_id()
+        claimed = []
+        conn = self.conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for url in urls:
+                conn.execute("DELETE FROM inflight WHERE url = ? AND expires < ?", (url, now))
+                if conn.execute("INSERT OR IGNORE INTO inflight VALUES (?, ?, ?)", (url, owner, now + lease)).rowcount:
+                    claimed.append(url)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return claimed
+
+    def release(self, urls):
+        """Ends the claims of the calling thread on the urls"""
+        owner = owner_id()
+        self.conn().executemany("DELETE FROM inflight WHERE url = ? AND owner = ?", [(url, owner) for url in urls])
+
+    def in_flight(self, urls):
+        """Returns the set of the urls claimed by a thread of any process"""
+        now = time.time()
+        found = set()
+        urls = list(urls)
+        for i in range(0, len(urls), 500):
+            chunk = urls[i:i + 500]
+            rows = self.conn().execute("SELECT url FROM inflight WHERE expires >= ? AND url IN ({})".format(','.join('?' * len(chunk))), [now] + chunk)
+            found.update(row[0] for row in rows)
+        return found
+
+    def clear(self):
+        self.conn().execute("DELETE FROM responses")
+
+
+cache = HalCache() if config.CACHE_ENABLED else None
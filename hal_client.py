@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from tenacity import Retrying, stop_after_attempt, wait_exponential, retry_if_exception
+import config
+from hal_cache import endpoint_of
+from metrics import metrics
+
+# -----HAL API CLIENT-------
+# All the requests to the HAL API go through a single client per process :
+# * a transport sending the requests : keep-alive connections pooled in one requests.Session by default,
+#   or an in-process stub of the HAL API for offline tests (see hal_stub.py)
+# * a global concurrency limit : the size of the thread pool running the requests, with their rate limit waits and retries
+# * a token bucket rate limiter, to stay polite with api.archives-ouvertes.fr
+# * retries with exponential backoff on network errors, 429 and 5xx responses
+# * metrics of each attempt by endpoint : latency, outcome (ok or the exception class) and bytes received (see metrics.py)
+
+
+class TokenBucket:
+    """Thread-safe token bucket : rate tokens per second, up to burst tokens"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Takes a token and returns the time to wait (in seconds) before using it"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+def is_retryable(exception):
+    if isinstance(exception, requests.HTTPError):
+        return (exception.response.status_code == 429) | (exception.response.status_code >= 500)
+    return isinstance(exception, requests.RequestException)
+
+
+class RequestsTransport:
+    """Sends the requests with a requests.Session keeping up to pool_size connections alive"""
+
+    def __init__(self, pool_size=config.HAL_MAX_CONCURRENCY):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, timeout):
+        """Returns the body of the response, raises a requests.RequestException on errors"""
+        resp = self.session.get(url, timeout=timeout)
+        resp.raise_for_status()
+        return resp.text
+
+
+class HalClient:
+
+    def __init__(self, max_concurrency=config.HAL_MAX_CONCURRENCY, rate=config.HAL_RATE, burst=config.HAL_BURST,
+                 timeout=config.HAL_TIMEOUT, retries=config.HAL_RETRIES, transport=None):
+        self.timeout = timeout
+        self.bucket = TokenBucket(rate, burst)
+        self.transport = transport if transport is not None else RequestsTransport(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='hal')
+        self.retry_options = dict(stop=stop_after_attempt(retries), wait=wait_exponential(multiplier=0.5, max=10),
+                                  retry=retry_if_exception(is_retryable), reraise=True)
+
+    def request(self, url, timeout=None, deadline=None):
+        timeout = timeout or self.timeout
+        if deadline is not None:
+            timeout = max(min(timeout, deadline - time.monotonic()), 0.01)
+        endpoint = endpoint_of(url)
+        start = time.perf_counter()
+        try:
+            body = self.transport.get(url, timeout)
+        except Exception as e:
+            status = e.response.status_code if isinstance(e, requests.HTTPError) else type(e).__name__
+            metrics.inc('aurehal_hal_requests_total', endpoint=endpoint, status=status)
+            raise
+        finally:
+            metrics.observe('aurehal_hal_request_seconds', time.perf_counter() - start, endpoint=endpoint)
+        metrics.inc('aurehal_hal_requests_total', endpoint=endpoint, status='ok')
+        metrics.inc('aurehal_hal_response_bytes_total', len(body.encode('utf-8')), endpoint=endpoint)
+        return body
+
+    def retrying(self, deadline=None):
+        """Retry options, with waits cut at the deadline (time.monotonic() value) if any and no new attempt after it"""
+        if deadline is None:
+            return self.retry_options
+        wait = self.retry_options['wait']
+        return dict(self.retry_options, stop=self.retry_options['stop'] | (lambda retry_state: time.monotonic() >= deadline),
+                    wait=lambda retry_state: max(min(wait(retry_state), deadline - time.monotonic()), 0))
+
+    def call(self, url, timeout=None, deadline=None):
+        """Request of an url with the rate limit and the retries, run by a thread of the pool"""
+        for attempt in Retrying(**self.retrying(deadline)):
+            with attempt:
+                time.sleep(self.bucket.reserve())
+                return self.request(url, timeout, deadline)
+
+    def get(self, url, timeout=None, deadline=None):
+        """
+        Sync request of an url, returns the response body.
+        The timeout of each attempt (self.timeout by default) is limited to the time left before the deadline (time.monotonic() value) if any.
+        """
+        return self.executor.submit(self.call, url, timeout, deadline).result()
+
+    def get_many(self, urls, timeout=None, deadline=None):
+        """Concurrent requests of a list of urls, returns the response bodies in the same order"""
+        return list(self.executor.map(lambda url: self.call(url, timeout, deadline), urls))
+
+
+client = HalClient()
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+# -----LOCAL HAL API STUB-------
+# Stand-in of the ref/structure and search HAL API endpoints used by the app, answering from a dict of records :
+# * recorded fixtures (a json file of records by docid, or a local snapshot of the referential, see snapshot.py)
+# * or a synthetic hierarchy with a configurable depth, fan-out and multi-parent rate
+# with injected latency and error rate. It can be served over http (python hal_stub.py, then AUREHAL_HAL_API_URL=http://localhost:8060/)
+# or plugged in-process in the HAL client with StubTransport.
+
+TYPES_BY_DEPTH = ['regroupinstitution', 'institution', 'regrouplaboratory', 'laboratory', 'department', 'researchteam']
+
+
+def synthetic(root=1, depth=3, fanout=5, multi_parent_rate=0.1, seed=0):
+    """
+    Function to generate a synthetic hierarchy of structures under a root.
+
+    Args
+    ----------
+    root (int, default 1) : the docid of the root, the other structures get the next docids
+    depth (int, default 3) : the number of levels under the root
+    fanout (int, default 5) : the number of children of each structure
+    multi_parent_rate (float, default 0.1) : the probability for a structure to get a second parent in the level of its first parent
+    seed (int, default 0) : the random seed
+
+    Return
+    -------
+    returns a dict of records by docid
+    Example : {1: {'parentDocid_i': [], 'acronym_s': 'S1', 'label_s': 'Structure 1',..., 'nb_publis': 532},...}
+    """
+    rng = random.Random(seed)
+    records = {}
+
+    def record(docid, level, parents):
+        records[docid] = {'parentDocid_i': parents, 'acronym_s': 'S{}'.format(docid), 'label_s': 'Structure {}'.format(docid),
+                          'valid_s': rng.choice(['VALID'] * 8 + ['OLD', 'INCOMING']), 'type_s': TYPES_BY_DEPTH[min(level, len(TYPES_BY_DEPTH) - 1)],
+                          'url_s': 'https://example.org/{}'.format(docid), 'updateDate_tdate': '2022-01-01T00:00:00Z',
+                          'nb_publis': rng.randint(0, 1000)}
+        if rng.random() < 0.5:
+            records[docid]['idref_s'] = ['{:09d}'.format(docid)]
+
+    record(root, 0, [])
+    level = [root]
+    next_id = root + 1
+    for d in range(1, depth + 1):
+        next_level = []
+        for parent in level:
+            for _ in range(fanout):
+                parents = [parent]
+                if (len(level) > 1) & (rng.random() < multi_parent_rate):
+                    other = rng.choice(level)
+                    if other != parent:
+                        parents.append(other)
+                record(next_id, d, parents)
+                next_level.append(next_id)
+                next_id += 1
+        level = next_level
+    return records
+
+
+def load_fixtures(path):
+    """Loads a json file of records by docid"""
+    with open(path) as f:
+        return {int(k): v for k, v in json.load(f).items()}
+
+
+def parse_query(q):
+    """
+    Parses the Solr queries sent by the app : *:*, field:value, field:"value", field:(a OR b OR ...) and field:[from TO to]
+    Returns a (field, values, range) tuple : the set of values for the first forms, the (from, to) bounds for the range form
+    """
+    if q.strip() == '*:*':
+        return None, None, None
+    field, expr = q.split(':', 1)
+    expr = expr.strip()
+    m = re.match(r'^\[(.*) TO (.*)\]$', expr)
+    if m:
+        return field, None, (m.group(1), m.group(2))
+    return field, set(v.strip().strip('"') for v in expr.strip('()').split(' OR ')), None
+
+
+class StubHal:
+    """Answers the HAL API urls from a dict of records by docid"""
+
+    def __init__(self, records, latency=0.0, error_rate=0.0, seed=0):
+        self.records = records
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.children = {}
+        for docid, record in records.items():
+            for parent in record.get('parentDocid_i', []):
+                self.children.setdefault(int(parent), []).append(docid)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes = 0
+
+    def match(self, q):
+        """Returns the sorted docids of the records matching a query"""
+        field, values, bounds = parse_query(q)
+        if field is None:
+            return sorted(self.records.keys())
+        if bounds is not None:
+            low, high = bounds
+            return sorted(docid for docid, record in self.records.items() if (field in record)
+                          and ((low == '*') or (str(record[field]) >= low)) and ((high == '*') or (str(record[field]) <= high)))
+        if field in ('docid', 'authStructId_i'):
+            return sorted(int(v) for v in values if int(v) in self.records)
+        if field == 'parentDocid_i':
+            return sorted(set(child for v in values for child in self.children.get(int(v), [])))
+        return sorted(docid for docid, record in self.records.items() if str(record.get(field)) in values)
+
+    def structure(self, params):
+        docids = self.match(params.get('q', ['*:*'])[0])
+        rows = int(params.get('rows', ['10'])[0])
+        fields = params.get('fl', ['docid'])[0].split(',')
+        resp = {'response': {'numFound': len(docids), 'start': 0, 'docs': []}}
+        if 'cursorMark' in params:
+            cursor = params['cursorMark'][0]
+            if cursor != '*':
+                docids = [docid for docid in docids if docid > int(cursor)]
+            page = docids[:rows]
+            resp['nextCursorMark'] = str(page[-1]) if page else cursor
+        else:
+            start = int(params.get('start', ['0'])[0])
+            page = docids[start:start + rows]
+            resp['response']['start'] = start
+        for docid in page:
+            record = dict(self.records[docid], docid=docid)
+            resp['response']['docs'].append({field: record[field] for field in fields if (field in record) and (record[field] not in ('', []))})
+        return resp
+
+    def search(self, params):
+        docids = self.match(params.get('q', ['*:*'])[0])
+        resp = {'response': {'numFound': sum(self.records[docid].get('nb_publis', 0) for docid in docids), 'start': 0, 'docs': []}}
+        if 'facet.query' in params:
+            resp['facet_counts'] = {'facet_queries': {}}
+            for query in params['facet.query']:
+                resp['facet_counts']['facet_queries'][query] = sum(self.records[docid].get('nb_publis', 0) for docid in self.match(query))
+        return resp
+
+    def answer(self, url):
+        """Returns the (http status, body) of the response to an url"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            error = self.rng.random() < self.error_rate
+        parsed = urlparse(url)
+        params = parse_qs(parsed.query)
+        if error:
+            status, body = 503, json.dumps({'error': 'injected error'})
+        elif parsed.path.rstrip('/').endswith('ref/structure'):
+            status, body = 200, json.dumps(self.structure(params))
+        elif parsed.path.rstrip('/').endswith('search'):
+            status, body = 200, json.dumps(self.search(params))
+        else:
+            status, body = 404, json.dumps({'error': 'unknown endpoint'})
+        with self.lock:
+            self.requests += 1
+            self.bytes += len(body)
+        return status, body
+
+
+class StubTransport:
+    """HAL client transport answering in-process from a StubHal (see hal_client.py)"""
+
+    def __init__(self, stub):
+        self.stub = stub
+
+    def get(self, url, timeout):
+        if (timeout is not None) and (self.stub.latency > timeout):
+            time.sleep(timeout)
+            raise requests.Timeout('read timeout ({}s) for url {}'.format(timeout, url))
+        status, body = self.stub.answer(url)
+        if status != 200:
+            resp = requests.Response()
+            resp.status_code = status
+            resp.url = url
+            raise requests.HTTPError('{} for url {}'.format(status, url), response=resp)
+        return body
+
+
+def serve(stub, host='127.0.0.1', port=8060):
+    """Starts a http server answering from the stub in a background thread, returns the server (server.shutdown() to stop it)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body = stub.answer(self.path)
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in of the HAL API (ref/structure and search endpoints)")
+    parser.add_argument('--port', type=int, default=8060)
+    parser.add_argument('--fixtures', help="json file of records by docid")
+    parser.add_argument('--snapshot', help="snapshot directory of the Aurehal referential (see snapshot.py)")
+    parser.add_argument('--root', type=int, default=1)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--fanout', type=int, default=5)
+    parser.add_argument('--multi-parent-rate', type=float, default=0.1)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to each response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="ratio of 503 responses")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.fixtures:
+        records = load_fixtures(args.fixtures)
+    elif args.snapshot:
+        from snapshot import Snapshot
+        records = Snapshot(args.snapshot).records()
+    else:
+        records = synthetic(args.root, args.depth, args.fanout, args.multi_parent_rate, args.seed)
+    server = serve(StubHal(records, args.latency, args.error_rate, args.seed), '127.0.0.1', args.port)
+    print('{} structures served on http://127.0.0.1:{}/'.format(len(records), args.port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
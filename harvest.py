@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from xml.sax.saxutils import escape, quoteattr
+import config
+import functions as fn
+from hal_client import client, TokenBucket
+from metrics import metrics
+from snapshot import META_FIELDS
+from graph_data import typed_nodes
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional, only needed by the parquet export
+    pa = None
+
+# -----BATCH HARVEST-------
+# Headless harvest of the graphs of a list of root structures, without the Dash app :
+# * the roots are harvested in parallel by a pool of processes, each one level by level with the metadata of the new structures (see run_job in jobs.py)
+# * the structures and edges of each level are written to the export files of the root as soon as they arrive and then dropped,
+#   only the visited docids and the level in progress stay in memory (the cycles of the referential are then not reported)
+# * the processes share the HAL responses cache, where the children, metadata and publications counts are kept by structure
+#   whatever the batches they were requested in (see hal_get_by_docid in functions.py), and the claims of the structures being requested
+#   (see HalCache.claim) : a structure reached from several roots is requested once, and the rate limit of config.HAL_RATE is split between them
+#
+# python harvest.py 1039632 409:asc --format jsonl --out exports
+# python harvest.py --roots-file roots.txt --format parquet --workers 8 --max-depth 3
+
+# columns of the exported structures
+NODE_FIELDS = ['id', 'nb_publis'] + META_FIELDS
+FORMATS = ['jsonl', 'parquet', 'graphml']
+
+
+def node_records(node_df):
+    """Records of the structures of a level with the NODE_FIELDS keys, typed as in the graphs of the app (see graph_data.py) and the missing values as None"""
+    df = typed_nodes(node_df)[NODE_FIELDS]
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+class JsonlWriter:
+    """One json record by line : {"type": "node", ...NODE_FIELDS} and {"type": "edge", "from": ..., "to": ...}"""
+
+    def __init__(self, path):
+        self.paths = [path + '.jsonl']
+        self.file = open(self.paths[0] + '.part', 'w', encoding='utf-8')
+
+    def write(self, nodes, edges):
+        for node in nodes:
+            self.file.write(json.dumps(dict(type='node', **node), ensure_ascii=False) + '\n')
+        for edge in edges:
+            self.file.write(json.dumps({'type': 'edge', 'from': int(edge['from']), 'to': int(edge['to'])}) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetWriter:
+    """Two parquet files, <root>_nodes.parquet and <root>_edges.parquet, with one row group by level"""
+
+    def __init__(self, path):
+        self.paths = [path + '_nodes.parquet', path + '_edges.parquet']
+        node_schema = pa.schema([(field, pa.int64() if field in ('id', 'nb_publis') else pa.string()) for field in NODE_FIELDS])
+        edge_schema = pa.schema([('from', pa.int64()), ('to', pa.int64())])
+        self.nodes = pq.ParquetWriter(self.paths[0] + '.part', node_schema)
+        self.edges = pq.ParquetWriter(self.paths[1] + '.part', edge_schema)
+
+    def write(self, nodes, edges):
+        if nodes:
+            self.nodes.write_table(pa.Table.from_pylist(nodes, schema=self.nodes.schema))
+        if edges:
+            self.edges.write_table(pa.Table.from_pydict({'from': [int(e['from']) for e in edges], 'to': [int(e['to']) for e in edges]},
+                                                        schema=self.edges.schema))
+
+    def close(self):
+        self.nodes.close()
+        self.edges.close()
+
+
+class GraphmlWriter:
+    """A directed GraphML graph, the nodes and edges elements of each level appended to the graph element"""
+
+    def __init__(self, path):
+        self.paths = [path + '.graphml']
+        self.file = open(self.paths[0] + '.part', 'w', encoding='utf-8')
+        self.file.write('<?xml version="1.0" encoding="UTF-8"?>\n<graphml xmlns="http://graphml.graphdrawing.org/xmlns">\n')
+        for field in NODE_FIELDS[1:]:
+            self.file.write('  <key id="{0}" for="node" attr.name="{0}" attr.type="{1}"/>\n'.format(field, 'long' if field == 'nb_publis' else 'string'))
+        self.file.write('  <graph id="G" edgedefault="directed">\n')
+
+    def write(self, nodes, edges):
+        for node in nodes:
+            data = ''.join('<data key="{}">{}</data>'.format(field, escape(str(node[field])))
+                           for field in NODE_FIELDS[1:] if node[field] is not None)
+            self.file.write('    <node id={}>{}</node>\n'.format(quoteattr(str(node['id'])), data))
+        for edge in edges:
+            self.file.write('    <edge source={} target={}/>\n'.format(quoteattr(str(edge['from'])), quoteattr(str(edge['to']))))
+        self.file.flush()
+
+    def close(self):
+        self.file.write('  </graph>\n</graphml>\n')
+        self.file.close()
+
+
+WRITERS = {'jsonl': JsonlWriter, 'parquet': ParquetWriter, 'graphml': GraphmlWriter}
+
+
+class StreamedResult(fn.HarvestResult):
+    """
+    Result of a streamed harvest : the edges are written by the on_level callback, only their number is kept
+    (so the walk keeps only its visited ids in memory, and the cycles of the referential are not reported)
+    """
+    count = 0
+
+    def extend(self, edges):
+        self.count += len(edges)
+
+
+def harvest_root(docid, direction, out, fmt, max_depth=None, deadline=None, max_nodes=None, timeout=None):
+    """
+    Function to harvest the graph of a structure with the metadata of its structures, and to stream it to export files.
+    The files are written with a .part suffix, removed when the harvest is complete.
+
+    Args
+    ----------
+    docid (str) : the docid HAL structure identifier
+    direction (str) : "desc" for the child structures, "asc" for the parent structures
+    out (str) : the directory of the export files, named <docid>_<direction>
+    fmt (str) : the export format, one of FORMATS
+    max_depth, deadline, max_nodes, timeout : the bounds of the harvest (see traverse)
+
+    Return
+    -------
+    returns a dict with the root, the export files, the numbers of structures and edges, the truncated flag and the duration in seconds
+    """
+    start = time.perf_counter()
+    writer = WRITERS[fmt](os.path.join(out, '{}_{}'.format(docid, direction)))
+    nb_nodes = [0]
+
+    def write_level(new_edges, new_ids):
+        nodes = node_records(fn.get_list_struct_infos(new_ids)) if new_ids else []
+        nb_nodes[0] += len(nodes)
+        writer.write(nodes, new_edges)
+
+    # the timeout and the deadline hold for the metadata of the root too
+    end = time.monotonic() + deadline if deadline is not None else None
+    limits = fn.request_timeout.set(timeout), fn.request_deadline.set(end)
+    try:
+        write_level([], [docid])
+        result = fn.traverse(docid, direction, result=StreamedResult(), on_level=write_level, max_depth=max_depth,
+                             deadline=max(end - time.monotonic(), 0) if end is not None else None, max_nodes=max_nodes, timeout=timeout)
+    except Exception:
+        metrics.inc('aurehal_harvests_total', direction=direction, status='error')
+        metrics.flush()
+        raise
+    finally:
+        fn.request_timeout.reset(limits[0])
+        fn.request_deadline.reset(limits[1])
+        writer.close()
+    for path in writer.paths:
+        os.replace(path + '.part', path)
+    metrics.inc('aurehal_harvests_total', direction=direction, status='done')
+    metrics.observe('aurehal_harvest_nodes', nb_nodes[0])
+    # the pool processes exit without the atexit handlers
+    metrics.flush()
+    return {'docid': docid, 'direction': direction, 'files': writer.paths, 'nodes': nb_nodes[0], 'edges': result.count,
+            'truncated': result.truncated, 'seconds': round(time.perf_counter() - start, 1)}
+
+
+def init_worker(workers):
+    """Splits the rate limit of the HAL client between the processes of the pool"""
+    logging.basicConfig(level=logging.WARNING)
+    client.bucket = TokenBucket(config.HAL_RATE / workers, max(config.HAL_BURST // workers, 1))
+
+
+def parse_root(text, direction):
+    """'1039632' or '1039632:asc' -> ('1039632', direction or 'asc')"""
+    docid, _, root_direction = text.strip().partition(':')
+    root_direction = root_direction or direction
+    if (not docid.isdigit()) or (root_direction not in ('desc', 'asc')):
+        raise ValueError(text)
+    return docid, root_direction
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Harvest the graphs of a list of structures in parallel and export them")
+    parser.add_argument('roots', nargs='*', help="docid or docid:direction (desc or asc)")
+    parser.add_argument('--roots-file', help="file of roots, one by line")
+    parser.add_argument('--direction', choices=['desc', 'asc'], default='desc', help="direction of the roots without one")
+    parser.add_argument('--format', choices=FORMATS, default='jsonl')
+    parser.add_argument('--out', default='exports')
+    parser.add_argument('--workers', type=int, default=config.JOBS_WORKERS)
+    parser.add_argument('--max-depth', type=int)
+    parser.add_argument('--deadline', type=float, help="time budget of each harvest in seconds")
+    parser.add_argument('--max-nodes', type=int)
+    parser.add_argument('--timeout', type=float, help="timeout of each HAL request in seconds")
+    args = parser.parse_args()
+    lines = list(args.roots)
+    if args.roots_file:
+        with open(args.roots_file) as f:
+            lines += [line for line in f if line.strip() and not line.startswith('#')]
+    try:
+        roots = list(dict.fromkeys(parse_root(line, args.direction) for line in lines))
+    except ValueError as e:
+        parser.error('invalid root {}'.format(e))
+    if not roots:
+        parser.error('no root')
+    if (args.format == 'parquet') and (pa is None):
+        parser.error('the parquet format needs pyarrow')
+    logging.basicConfig(level=logging.WARNING)
+    os.makedirs(args.out, exist_ok=True)
+    workers = max(min(args.workers, len(roots)), 1)
+    failed = 0
+    # spawned processes : no sqlite connection or thread pool of this process is inherited
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker, initargs=(workers,)) as executor:
+        futures = {executor.submit(harvest_root, docid, direction, args.out, args.format, args.max_depth, args.deadline,
+                                   args.max_nodes, args.timeout): (docid, direction) for docid, direction in roots}
+        for future in as_completed(futures):
+            docid, direction = futures[future]
+            try:
+                print(json.dumps(future.result()))
+            except Exception as e:
+                failed += 1
+                logging.error('harvest of {} {} failed : {!r}'.format(docid, direction, e))
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import json
+import time
+import uuid
+import logging
+import contextvars
+import hashlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import functions as fn
+from graph_store import store
+from search_index import SearchIndex
+from graph_data import HarvestGraph
+from singleflight import process_locks
+from metrics import metrics
+import config
+
+# -----BACKGROUND HARVEST JOBS-------
+# The harvests run in a local pool of worker threads instead of the Dash callbacks.
+# The state of a job (status, progress counters) is written in config.JOBS_DIR after each level, and the graph harvested so far
+# is saved in the graph store under the job id (see graph_store.py and graph_data.py) with its search index (see search_index.py),
+# so that any gunicorn worker can answer the polling of the page, and a job is cancelled by creating its .cancel file.
+# Identical harvests (same docid, direction and options) are coalesced : while a job runs, the later submissions attach to it,
+# whatever the worker they come from (the <key>.current file gives the running job of a key).
+# The log lines of a job (HAL calls, warnings) are kept in a ring buffer of the job, copied in its state for the console of the page.
+# A harvest limited in depth, or stopped by its time or nodes budget (config.JOBS_DEADLINE, config.JOBS_MAX_NODES), keeps the structures left
+# unexplored (frontier) in its graph, they can then be expanded one by one (expand_node).
+
+executor = ThreadPoolExecutor(max_workers=config.JOBS_WORKERS, thread_name_prefix='harvest')
+
+# id of the job of the current thread context, for its log lines
+log_scope = contextvars.ContextVar('log_scope', default=None)
+
+
+class JobLogHandler(logging.Handler):
+    """Keeps the last config.JOBS_LOG_LINES log lines of each running job, numbered so that the console only fetches the new ones"""
+
+    def __init__(self, size=config.JOBS_LOG_LINES):
+        logging.Handler.__init__(self, level=logging.INFO)
+        self.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s', '%H:%M:%S'))
+        self.size = size
+        self.buffers_lock = threading.Lock()
+        # job id -> {'seq': number of the last line, 'lines': deque of [number, line]}
+        self.buffers = {}
+
+    def emit(self, record):
+        job_id = log_scope.get()
+        if job_id is None:
+            return
+        line = self.format(record)
+        with self.buffers_lock:
+            buffer = self.buffers.setdefault(job_id, {'seq': 0, 'lines': deque(maxlen=self.size)})
+            buffer['seq'] += 1
+            buffer['lines'].append([buffer['seq'], line])
+
+    def snapshot(self, job_id):
+        with self.buffers_lock:
+            buffer = self.buffers.get(job_id)
+            return {'seq': buffer['seq'], 'lines': list(buffer['lines'])} if buffer is not None else None
+
+    def restore(self, job_id, log):
+        """Restarts the buffer of a job from the log saved in its state"""
+        with self.buffers_lock:
+            self.buffers[job_id] = {'seq': log['seq'], 'lines': deque(log['lines'], maxlen=self.size)}
+
+    def drop(self, job_id):
+        with self.buffers_lock:
+            self.buffers.pop(job_id, None)
+
+
+log_handler = JobLogHandler()
+logging.getLogger().addHandler(log_handler)
+
+
+# the job ids come back from the browser (dcc.Store) : only the uuid4 hex of submit_job can name a file
+JOB_ID = re.compile('[0-9a-f]{32}')
+
+
+def valid_id(job_id):
+    return isinstance(job_id, str) and (JOB_ID.fullmatch(job_id) is not None)
+
+
+def state_path(job_id):
+    if not valid_id(job_id):
+        raise ValueError('invalid job id {!r}'.format(job_id))
+    return os.path.join(config.JOBS_DIR, '{}.json'.format(job_id))
+
+
+def cancel_path(job_id):
+    if not valid_id(job_id):
+        raise ValueError('invalid job id {!r}'.format(job_id))
+    return os.path.join(config.JOBS_DIR, '{}.cancel'.format(job_id))
+
+
+def write_state(state):
+    state['version'] += 1
+    state['updated'] = time.time()
+    state['log'] = log_handler.snapshot(state['id']) or state.get('log') or {'seq': 0, 'lines': []}
+    tmp = state_path(state['id']) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, state_path(state['id']))
+
+
+def job_key(docid, direction, **options):
+    """Returns the key identifying the identical harvests"""
+    key = json.dumps([int(docid), direction, options], sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def current_path(key):
+    return os.path.join(config.JOBS_DIR, '{}.current'.format(key))
+
+
+def is_alive(job):
+    return (job is not None) and (job['status'] == 'running') and (time.time() - job['updated'] < config.JOBS_STALE)
+
+
+def get_log(job_id, cursor=0):
+    """Returns the number of the last log line of a job and its lines after the cursor (the ones still in its ring buffer)"""
+    log = log_handler.snapshot(job_id) if valid_id(job_id) else None
+    if log is None:
+        job = get_job(job_id)
+        log = job['log'] if job is not None else {'seq': 0, 'lines': []}
+    return log['seq'], [line for seq, line in log['lines'] if seq > cursor]
+
+
+def get_job(job_id):
+    """Returns the state of a job or None"""
+    if not valid_id(job_id):
+        return None
+    try:
+        with open(state_path(job_id)) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def cancel_job(job_id):
+    if valid_id(job_id):
+        open(cancel_path(job_id), 'w').close()
+
+
+def is_cancelled(job_id):
+    return valid_id(job_id) and os.path.exists(cancel_path(job_id))
+
+
+def cleanup():
+    """Deletes the files of the jobs older than config.JOBS_TTL"""
+    store.cleanup()
+    limit = time.time() - config.JOBS_TTL
+    for name in os.listdir(config.JOBS_DIR):
+        path = os.path.join(config.JOBS_DIR, name)
+        try:
+            if os.path.getmtime(path) < limit:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def run_job(state):
+    """Harvests the graph of a job level by level, with the metadata of the new structures of each level, and saves it in the graph store after each level"""
+    fn.harvest_progress.set(state['progress'])
+    log_scope.set(state['id'])
+    # the time budget and the requests timeout hold for the whole job, the metadata of the structures included
+    end = time.monotonic() + config.JOBS_DEADLINE
+    fn.request_timeout.set(config.JOBS_REQUEST_TIMEOUT)
+    fn.request_deadline.set(end)
+    graph = [HarvestGraph(index=SearchIndex())]
+    # time spent on the metadata of the structures, the rest of the job is the graph walk
+    metadata_time = [0]
+
+    def infos(ids):
+        start = time.perf_counter()
+        node_df = fn.get_list_struct_infos(ids)
+        metadata_time[0] += time.perf_counter() - start
+        return node_df
+
+    def save():
+        store.put(state['id'], graph[0])
+        state['progress']['nodes'] = len(graph[0])
+        state['progress']['edges'] = len(graph[0].src)
+        write_state(state)
+
+    def on_level(new_edges, new_ids):
+        graph[0] = graph[0].add(infos(new_ids) if new_ids else None, new_edges)
+        state['progress']['levels'] += 1
+        save()
+
+    start = time.perf_counter()
+    try:
+        graph[0] = graph[0].add(infos([state['docid']]), [])
+        save()
+        result = fn.traverse(state['docid'], state['direction'], on_level=on_level, cancelled=lambda: is_cancelled(state['id']),
+                             max_depth=state['max_depth'], deadline=max(end - time.monotonic(), 0), max_nodes=config.JOBS_MAX_NODES,
+                             timeout=config.JOBS_REQUEST_TIMEOUT)
+        state['truncated'] = result.truncated
+        if result.frontier and not is_cancelled(state['id']):
+            graph[0] = graph[0].add(None, [], frontier=result.frontier)
+            save()
+        state['status'] = 'cancelled' if is_cancelled(state['id']) else 'done'
+    except Exception as e:
+        if time.monotonic() >= end:
+            # the metadata of the root failed after the deadline (the ones of the levels are handled by traverse)
+            logging.warning('harvest job {} stopped by its deadline : {!r}'.format(state['id'], e))
+            state['status'] = 'done'
+            state['truncated'] = True
+        else:
+            logging.exception('harvest job {} failed'.format(state['id']))
+            state['status'] = 'error'
+            state['error'] = str(e)
+    write_state(state)
+    metrics.inc('aurehal_harvests_total', direction=state['direction'], status=state['status'])
+    metrics.observe('aurehal_harvest_seconds', time.perf_counter() - start - metadata_time[0], phase='harvest')
+    metrics.observe('aurehal_harvest_seconds', metadata_time[0], phase='metadata')
+    metrics.observe('aurehal_harvest_nodes', state['progress']['nodes'])
+    # the last lines stay in the state of the job
+    log_handler.drop(state['id'])
+
+
+def submit_job(docid, direction, max_depth=None):
+    """
+    Function to start the harvest of the graph of a structure in background.
+
+    Args
+    ----------
+    docid (str|int) : the docid HAL structure identifier
+    direction (str) : "desc" for the child structures, "asc" for the parent structures
+    max_depth (int, default None) : the number of levels to harvest, all of them by default
+
+    Return
+    -------
+    returns the job id, to follow the job with get_job(job_id). It is the id of the running job if the same harvest is already in progress.
+    """
+    os.makedirs(config.JOBS_DIR, exist_ok=True)
+    cleanup()
+    key = job_key(docid, direction, max_depth=max_depth)
+    with process_locks(['job:' + key]):
+        try:
+            with open(current_path(key)) as f:
+                running = get_job(f.read().strip())
+        except FileNotFoundError:
+            running = None
+        if is_alive(running) and not is_cancelled(running['id']):
+            return running['id']
+        state = {'id': uuid.uuid4().hex, 'key': key, 'docid': docid, 'direction': direction, 'max_depth': max_depth, 'status': 'running', 'error': None, 'truncated': False,
+                 'progress': {'levels': 0, 'nodes': 0, 'edges': 0, 'requests': 0}, 'version': 0}
+        write_state(state)
+        with open(current_path(key), 'w') as f:
+            f.write(state['id'])
+    # the job gets a fresh context, the harvest progress of another job must not leak in it
+    executor.submit(contextvars.Context().run, run_job, state)
+    return state['id']
+
+
+def is_expanding(job):
+    return (job is not None) and (job.get('expanding') is not None) and (time.time() - job['updated'] < config.JOBS_STALE)
+
+
+def expand_node(job_id, node_id):
+    """
+    Function to start the harvest of the children (or parents, following the direction of the job) of a structure of the frontier of a finished job,
+    with their metadata, in background. They are merged in the graph of the job and are the new frontier, the page gets them by polling the job.
+
+    Args
+    ----------
+    job_id (str) : the job id
+    node_id (str|int) : the id of the structure, as in the graph
+
+    Return
+    -------
+    returns the version of the job marked as expanding the structure, or None if the structure is not in the frontier of the graph
+    or if another structure of the graph is being expanded
+    """
+    if not valid_id(job_id):
+        return None
+    # the lock is only held to mark the job, the expansion reads and replaces its graph alone
+    with process_locks(['expand:' + job_id]):
+        state = get_job(job_id)
+        graph = store.get(job_id)
+        if (state is None) or (state['status'] == 'running') or is_expanding(state) or (graph is None) or (int(node_id) not in graph.frontier):
+            return None
+        state['expanding'] = int(node_id)
+        write_state(state)
+    executor.submit(contextvars.Context().run, run_expansion, state, node_id)
+    return state['version']
+
+
+def run_expansion(state, node_id):
+    """Harvests the neighbours of a structure of the frontier of a job with their metadata, and saves the graph with the new frontier"""
+    job_id = state['id']
+    fn.harvest_progress.set(state['progress'])
+    log_scope.set(job_id)
+    # the time budget and the requests timeout hold for the metadata of the neighbours too
+    end = time.monotonic() + config.JOBS_DEADLINE
+    fn.request_timeout.set(config.JOBS_REQUEST_TIMEOUT)
+    fn.request_deadline.set(end)
+    if state.get('log'):
+        # the numbering of the lines goes on from the lines of the harvest
+        log_handler.restore(job_id, state['log'])
+    graph = store.get(job_id)
+    new_edges, new_ids, new_nodes = [], [], None
+    try:
+        result = fn.traverse(node_id, state['direction'], max_depth=1, deadline=config.JOBS_DEADLINE, timeout=config.JOBS_REQUEST_TIMEOUT)
+        truncated = result.truncated
+        if not truncated:
+            new_edges = list(result)
+            neighbours = pd.unique(pd.Series([e['to'] if state['direction'] == 'desc' else e['from'] for e in new_edges], dtype=object).astype('int64'))
+            new_ids = [i for i, row in zip(neighbours, graph.rows(neighbours)) if row < 0]
+            new_nodes = fn.get_list_struct_infos(new_ids) if new_ids else None
+    except Exception as e:
+        if time.monotonic() < end:
+            logging.exception('expansion of {} failed'.format(node_id))
+            state['status'] = 'error'
+            state['error'] = str(e)
+            state['expanding'] = None
+            write_state(state)
+            log_handler.drop(job_id)
+            return
+        logging.warning('expansion of {} stopped by its deadline : {!r}'.format(node_id, e))
+        new_edges, new_ids, new_nodes, truncated = [], [], None, True
+    # a new graph : the render attributes cached with the previous one (see app.py) are recomputed.
+    # A structure whose expansion has been stopped by the deadline stays in the frontier
+    frontier = [i for i in graph.frontier if truncated or (i != int(node_id))] + new_ids
+    graph = graph.add(new_nodes, new_edges, frontier=frontier)
+    if truncated:
+        state['truncated'] = True
+    store.put(job_id, graph)
+    state['progress']['nodes'] = len(graph)
+    state['progress']['edges'] = len(graph.src)
+    state['expanding'] = None
+    write_state(state)
+    log_handler.drop(job_id)
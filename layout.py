@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+import numpy as np
+import config
+
+# -----SERVER-SIDE LAYOUT OF A GRAPH-------
+# Hierarchical layout computed once per graph version (see render_frame in app.py) so that the browser gets fixed positions and no physics :
+# * the levels are given by the longest path from the roots (a structure is one level under its lowest parent)
+# * the order of the structures in a level reduces the edges crossings with barycenter sweeps, down (on the parents) then up (on the children)
+# The structures are also hung on a spanning tree (each one under one of its parents of the level above) to collapse the large subtrees in
+# cluster nodes. The nodes are the positions 0..n-1 (rows of the nodes dataframe of the graph) and the edges go from the parent to the child.
+
+
+def longest_path_levels(n, edges):
+    """Returns the level of each node : 0 for the roots, else 1 + the max level of its parents (the nodes of a cycle are put under their known parents)"""
+    parents = [[] for _ in range(n)]
+    indegree = [0] * n
+    children = [[] for _ in range(n)]
+    for u, v in edges:
+        children[u].append(v)
+        parents[v].append(u)
+        indegree[v] += 1
+    levels = [0] * n
+    done = [False] * n
+    queue = deque(i for i in range(n) if indegree[i] == 0)
+    while queue:
+        u = queue.popleft()
+        done[u] = True
+        for v in children[u]:
+            levels[v] = max(levels[v], levels[u] + 1)
+            indegree[v] -= 1
+            if indegree[v] == 0:
+                queue.append(v)
+    for v in [v for v in range(n) if not done[v]]:
+        known = [levels[u] for u in parents[v] if done[u]]
+        levels[v] = max(known) + 1 if known else 0
+        done[v] = True
+    return np.array(levels, dtype=int), parents, children
+
+
+def barycenter_order(levels, parents, children, sweeps=config.LAYOUT_SWEEPS):
+    """Returns the rank of each node in its level after the crossing reduction sweeps"""
+    layers = [[] for _ in range(levels.max() + 1 if len(levels) else 0)]
+    for v in range(len(levels)):
+        layers[levels[v]].append(v)
+    rank = [0] * len(levels)
+    for layer in layers:
+        for i, v in enumerate(layer):
+            rank[v] = i
+
+    def sweep(layer, neighbours):
+        # the nodes without neighbours keep their rank
+        keys = [sum(rank[u] for u in neighbours[v]) / len(neighbours[v]) if neighbours[v] else rank[v] for v in layer]
+        ordered = [layer[i] for i in np.argsort(keys, kind='stable')]
+        for i, v in enumerate(ordered):
+            rank[v] = i
+        return ordered
+
+    for _ in range(sweeps):
+        for i in range(1, len(layers)):
+            layers[i] = sweep(layers[i], parents)
+        for i in range(len(layers) - 2, -1, -1):
+            layers[i] = sweep(layers[i], children)
+    return np.array(rank, dtype=int), layers
+
+
+class GraphLayout:
+
+    def __init__(self, n, edges):
+        self.levels, parents, children = longest_path_levels(n, edges)
+        self.rank, layers = barycenter_order(self.levels, parents, children)
+        # centered coordinates for a top-down layout
+        widths = np.array([len(layer) for layer in layers])
+        self.x = (self.rank - (widths[self.levels] - 1) / 2) * config.LAYOUT_NODE_SPACING if n else np.zeros(0)
+        self.y = self.levels * config.LAYOUT_LEVEL_SEPARATION
+        # spanning tree : each node under its parent of the level above with the lowest rank, and the sizes of the subtrees
+        levels, rank = self.levels.tolist(), self.rank.tolist()
+        self.tree_parent = np.full(n, -1)
+        for v in range(n):
+            above = [u for u in parents[v] if levels[u] == levels[v] - 1]
+            if above:
+                self.tree_parent[v] = min(above, key=lambda u: rank[u])
+        self.order = [v for layer in layers for v in layer]
+        self.subtree = np.ones(n, dtype=int)
+        for v in reversed(self.order):
+            if self.tree_parent[v] >= 0:
+                self.subtree[self.tree_parent[v]] += self.subtree[v]
+
+    def positions(self, direction='UD'):
+        """Returns the (x, y) arrays of the nodes for a hierarchical direction (UD, DU, LR, RL)"""
+        if direction == 'DU':
+            return self.x, -self.y
+        if direction == 'LR':
+            return self.y, self.x
+        if direction == 'RL':
+            return -self.y, self.x
+        return self.x, self.y
+
+    def clusters(self, expanded, size=config.LAYOUT_CLUSTER_SIZE):
+        """
+        Returns the masks of the collapsed nodes (subtree larger than size, not expanded and not a root)
+        and of the hidden nodes (under a collapsed node in the spanning tree)
+        """
+        collapsed = (self.subtree > size) & (self.tree_parent >= 0)
+        collapsed[list(expanded)] = False
+        hidden = [False] * len(self.subtree)
+        tree_parent, folded = self.tree_parent.tolist(), collapsed.tolist()
+        for v in self.order:
+            p = tree_parent[v]
+            if p >= 0:
+                hidden[v] = hidden[p] or folded[p]
+        hidden = np.array(hidden, dtype=bool)
+        return collapsed & ~hidden, hidden
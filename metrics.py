@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+import config
+
+# -----METRICS-------
+# Counters and histograms of the HAL requests, of the cache and of the harvests, exposed in the Prometheus text format (route metrics of app.py).
+# Each process (gunicorn worker, batch harvest) keeps its values in memory and writes them in config.METRICS_DIR/<pid>.json
+# every config.METRICS_FLUSH seconds at most, the route sums the files of all the processes and deletes the ones of the dead processes.
+
+# upper bounds of the histograms buckets by metric
+BUCKETS = {
+    'aurehal_hal_request_seconds': [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30],
+    'aurehal_harvest_seconds': [1, 5, 15, 30, 60, 120, 300, 600],
+    'aurehal_harvest_nodes': [10, 100, 1000, 10000, 100000],
+    'aurehal_render_seconds': [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5],
+}
+HELP = {
+    'aurehal_hal_requests_total': 'HAL API requests by endpoint and outcome',
+    'aurehal_hal_response_bytes_total': 'Bytes received from the HAL API by endpoint',
+    'aurehal_hal_request_seconds': 'Latency of the HAL API requests by endpoint',
+    'aurehal_hal_cache_lookups_total': 'Lookups in the HAL responses cache by endpoint and result (hit, stale, miss)',
+    'aurehal_harvests_total': 'Harvest jobs by direction and final status',
+    'aurehal_harvest_seconds': 'Duration of the harvest jobs by phase (harvest : graph walk, metadata : structures metadata)',
+    'aurehal_harvest_nodes': 'Number of structures by harvest job',
+    'aurehal_render_seconds': 'Duration of the rendering callbacks by step',
+}
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # a process of another user
+        return True
+    return True
+
+
+def labels_key(labels):
+    return json.dumps(sorted(labels.items()))
+
+
+class Metrics:
+
+    def __init__(self, path=config.METRICS_DIR, flush_every=config.METRICS_FLUSH):
+        self.path = path
+        self.flush_every = flush_every
+        self.lock = threading.Lock()
+        self.last_flush = 0
+        # name -> labels key -> value for the counters, [bucket counts..., sum, count] for the histograms
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            key = labels_key(labels)
+            series[key] = series.get(key, 0) + value
+        self.maybe_flush()
+
+    def observe(self, name, value, **labels):
+        buckets = BUCKETS[name]
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            values = series.setdefault(labels_key(labels), [0] * (len(buckets) + 2))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    values[i] += 1
+            values[-2] += value
+            values[-1] += 1
+        self.maybe_flush()
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes the duration of the block in the histogram"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """Writes the values of the process in its file"""
+        with self.lock:
+            self.last_flush = time.monotonic()
+            data = json.dumps({'counters': self.counters, 'histograms': self.histograms})
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            file = os.path.join(self.path, '{}.json'.format(os.getpid()))
+            with open(file + '.tmp', 'w') as f:
+                f.write(data)
+            os.replace(file + '.tmp', file)
+        except OSError:
+            pass
+
+    def collect(self):
+        """Returns the sum of the values written by the running processes, the files of the dead ones are deleted"""
+        self.flush()
+        counters, histograms = {}, {}
+        for name in os.listdir(self.path):
+            if not name.endswith('.json'):
+                continue
+            pid = name[:-len('.json')]
+            if pid.isdigit() and not is_alive(int(pid)):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except FileNotFoundError:
+                    pass
+                continue
+            try:
+                with open(os.path.join(self.path, name)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for metric, series in data['counters'].items():
+                for key, value in series.items():
+                    counters.setdefault(metric, {})
+                    counters[metric][key] = counters[metric].get(key, 0) + value
+            for metric, series in data['histograms'].items():
+                for key, values in series.items():
+                    merged = histograms.setdefault(metric, {}).setdefault(key, [0] * len(values))
+                    histograms[metric][key] = [a + b for a, b in zip(merged, values)]
+        return counters, histograms
+
+    def render(self):
+        """Returns the metrics of all the processes in the Prometheus text format"""
+        counters, histograms = self.collect()
+
+        def labels_text(key, **extra):
+            labels = dict(json.loads(key), **extra)
+            if not labels:
+                return ''
+            return '{' + ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"')) for k, v in sorted(labels.items())) + '}'
+
+        lines = []
+        for name in sorted(counters):
+            lines += ['# HELP {} {}'.format(name, HELP.get(name, name)), '# TYPE {} counter'.format(name)]
+            lines += ['{}{} {}'.format(name, labels_text(key), value) for key, value in sorted(counters[name].items())]
+        for name in sorted(histograms):
+            lines += ['# HELP {} {}'.format(name, HELP.get(name, name)), '# TYPE {} histogram'.format(name)]
+            for key, values in sorted(histograms[name].items()):
+                # the counts are already cumulative (observe counts a value in every bucket whose bound is above it)
+                for bound, count in zip(BUCKETS[name], values):
+                    lines.append('{}_bucket{} {}'.format(name, labels_text(key, le=bound), count))
+                lines.append('{}_bucket{} {}'.format(name, labels_text(key, le='+Inf'), values[-1]))
+                lines.append('{}_sum{} {}'.format(name, labels_text(key), values[-2]))
+                lines.append('{}_count{} {}'.format(name, labels_text(key), values[-1]))
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+atexit.register(metrics.flush)
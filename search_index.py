@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import re
+import bisect
+import unicodedata
+from collections import defaultdict
+
+# -----SEARCH INDEX OF A GRAPH-------
+# Index of the structures of a harvested graph for the search box of the page, built level by level with the harvest (see jobs.py)
+# and kept with the graph in the graph store. The label_s, acronym_s and id of the structures are normalized (no accents, case folded) and :
+# * the queries of 3 characters or more are answered with a trigram index : the candidates are the structures of the rarest trigram of the query,
+#   then checked for the whole query
+# * the shorter ones with a sorted list of the words, the structures having a word starting with the query match
+# The positions returned are the rows of the nodes dataframe of the graph, in the order they were added.
+
+FIELDS = ['label_s', 'acronym_s', 'id']
+
+
+def normalize(text):
+    """Lowercase text without the accents, 'Université Côte d'Azur' -> 'universite cote d'azur'"""
+    text = unicodedata.normalize('NFKD', str(text))
+    return ''.join(c for c in text if not unicodedata.combining(c)).casefold()
+
+
+def trigrams(text):
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class SearchIndex:
+
+    def __init__(self):
+        # position -> node id as given in the graph, normalized searchable text, harvest depth
+        self.ids = []
+        self.texts = []
+        self.depths = []
+        self.positions = {}
+        self.grams = defaultdict(list)
+        self.words = []
+        # position -> positions of the neighbours one level closer to the root of the harvest
+        self.up = defaultdict(list)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, node_df, edges):
+        """
+        Indexes new structures and the edges linking them to the graph.
+
+        Args
+        ----------
+        node_df (dataframe|None) : the new structures, with the id column and the FIELDS columns when present
+        edges (list of dicts) : the new edges, with "from" and "to" keys
+        """
+        start = len(self.ids)
+        words = []
+        columns = [node_df[field] if field in node_df.columns else [None] * len(node_df) for field in FIELDS] if node_df is not None else [[]]
+        for values in zip(*columns):
+            pos = len(self.ids)
+            self.ids.append(values[-1])
+            self.positions[str(values[-1])] = pos
+            self.texts.append('\n'.join(normalize(v) for v in values if (v is not None) and (v == v)))
+            self.depths.append(None)
+            for gram in trigrams(self.texts[pos]):
+                self.grams[gram].append(pos)
+            words.extend((word, pos) for word in re.split(r'\W+', self.texts[pos]) if word)
+        # a new sorted list is swapped in, a graph being harvested is read by the page while the job adds its levels
+        self.words = sorted(self.words + words)
+        links = [(self.positions.get(str(e['from'])), self.positions.get(str(e['to']))) for e in edges]
+        links = [(a, b) for a, b in links if (a is not None) and (b is not None)]
+        # depth of the new structures : distance to the structures already indexed (to the first one for the first call)
+        if start < len(self.ids):
+            if start == 0:
+                self.depths[0] = 0
+            neighbours = defaultdict(list)
+            for a, b in links:
+                neighbours[a].append(b)
+                neighbours[b].append(a)
+            level = [pos for pos in range(len(self.ids)) if self.depths[pos] is not None]
+            while level:
+                next_level = []
+                for pos in level:
+                    for other in neighbours[pos]:
+                        if self.depths[other] is None:
+                            self.depths[other] = self.depths[pos] + 1
+                            next_level.append(other)
+                level = next_level
+        for a, b in links:
+            if (self.depths[a] is None) or (self.depths[b] is None) or (self.depths[a] == self.depths[b]):
+                continue
+            if self.depths[a] > self.depths[b]:
+                self.up[a].append(b)
+            else:
+                self.up[b].append(a)
+
+    def search(self, query):
+        """Returns the sorted positions of the structures matching a query"""
+        query = normalize(query).strip()
+        if not query:
+            return list(range(len(self.ids)))
+        if len(query) < 3:
+            start = bisect.bisect_left(self.words, (query,))
+            end = bisect.bisect_left(self.words, (query + '\uffff',))
+            return sorted(set(pos for word, pos in self.words[start:end]))
+        candidates = min((self.grams.get(gram, []) for gram in trigrams(query)), key=len)
+        return [pos for pos in candidates if query in self.texts[pos]]
+
+    def ancestors(self, positions):
+        """Returns the positions of the structures on the paths from the given ones to the root of the harvest (given ones included)"""
+        seen = set(positions)
+        stack = list(positions)
+        while stack:
+            for other in self.up.get(stack.pop(), []):
+                if other not in seen:
+                    seen.add(other)
+                    stack.append(other)
+        return sorted(seen)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+import threading
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import Future
+import config
+try:
+    import fcntl
+except ImportError:  # no file locks on Windows, the coalescing is then limited to the threads of a process
+    fcntl = None
+
+# -----SINGLE-FLIGHT COALESCING-------
+# Identical work started concurrently is done once :
+# * between the threads of a process, the later callers wait for the Future of the first one
+# * between processes (gunicorn workers, batch harvests), the harvest jobs take exclusive file locks in config.LOCKS_DIR :
+#   the later process waits for the lock and then finds the job already started.
+#   The HAL requests are not locked, each url is claimed in the responses cache during its request only (see HalCache.claim),
+#   so that the requests of unrelated structures never wait for each other
+
+
+class SingleFlight:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def claim(self, keys):
+        """
+        Splits keys between the ones the caller must compute (owned) and the ones already in flight in another thread
+        Returns (owned keys, {key: Future of the other thread}), the Future of a call gives the dict of the results of its keys
+        """
+        owned = []
+        waiting = {}
+        future = Future()
+        with self.lock:
+            for key in keys:
+                if key in self.calls:
+                    waiting[key] = self.calls[key]
+                else:
+                    self.calls[key] = future
+                    owned.append(key)
+        return owned, waiting
+
+    def resolve(self, keys, results=None, error=None):
+        """Publishes the results by key (or the error) of the owned keys of a call to the waiting threads"""
+        with self.lock:
+            futures = set(self.calls.pop(key) for key in keys)
+        for future in futures:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(results)
+
+
+def lock_path(key):
+    return os.path.join(config.LOCKS_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.lock')
+
+
+@contextmanager
+def process_locks(keys):
+    """Holds the exclusive file locks of the keys, taken in sorted order so that two processes can't deadlock"""
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(config.LOCKS_DIR, exist_ok=True)
+    with ExitStack() as stack:
+        for key in sorted(set(keys)):
+            f = stack.enter_context(open(lock_path(key), 'a'))
+            fcntl.flock(f, fcntl.LOCK_EX)
+            stack.callback(fcntl.flock, f, fcntl.LOCK_UN)
+        yield
+
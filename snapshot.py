@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import shutil
+import argparse
+import logging
+import time
+import numpy as np
+import config
+from hal_cache import cache
+from hal_client import client
+
+# -----AUREHAL REFERENTIAL SNAPSHOT-------
+# Local mirror of the ref/structure referential, stored as numpy files in config.SNAPSHOT_DIR :
+# * docids.npy : the sorted docids of all the structures (int32)
+# * children_indptr.npy/children.npy and parents_indptr.npy/parents.npy : the parent->children and child->parents adjacency lists (CSR layout)
+# * <field>.bin/<field>_offsets.npy : one utf-8 column by metadata field (values of the row i are bin[offsets[i]:offsets[i+1]])
+# * meta.json : the snapshot infos (date, number of structures, sync watermark)
+# All the files are memory-mapped so the gunicorn workers share the same pages.
+
+META_FIELDS = ['acronym_s', 'label_s', 'valid_s', 'type_s', 'idref_s', 'address_s', 'url_s']
+UPDATE_FIELD = 'updateDate_tdate'
+
+
+def harvest_records(query='*:*', fields=None):
+    """
+    Function to page through the ref/structure HAL API with a cursorMark and get the parents and metadata of all the matching structures.
+
+    Args
+    ----------
+    query (str, default '*:*') : the q param of the request
+    fields (list, default None) : the fields of the records, the parents, the META_FIELDS and the UPDATE_FIELD by default
+
+    Return
+    -------
+    returns a dict of records by docid
+    Example : {1039632: {'parentDocid_i': [], 'acronym_s': 'UCA', 'label_s': "Université Côte d'Azur",...},...}
+    """
+    if fields is None:
+        fields = ['parentDocid_i'] + META_FIELDS + [UPDATE_FIELD]
+    records = {}
+    cursor = '*'
+    while True:
+        url = config.HAL_API_URL + 'ref/structure/?wt=json&rows={}&q={}&sort=docid asc&cursorMark={}&fl={}'.format(
+            config.SNAPSHOT_ROWS, query, cursor, ','.join(['docid'] + fields))
+        logging.info(url)
+        resp = json.loads(client.get(url))
+        for doc in resp['response']['docs']:
+            records[doc.pop('docid')] = doc
+        if resp['nextCursorMark'] == cursor:
+            break
+        cursor = resp['nextCursorMark']
+    return records
+
+
+def field_value(record, field):
+    """Value of a metadata field of a record as it is stored in the snapshot : multivalued fields (idref_s) joined by a tab, '' if missing"""
+    value = record.get(field, '')
+    return '\t'.join(value) if isinstance(value, list) else str(value)
+
+
+def same_record(record, other):
+    """True if the two records are stored alike in the snapshot (same parents and metadata)"""
+    return ([int(p) for p in record.get('parentDocid_i', [])] == [int(p) for p in other.get('parentDocid_i', [])]) and \
+        all(field_value(record, field) == field_value(other, field) for field in META_FIELDS)
+
+
+def csr(lists, docids):
+    """Builds the (indptr, indices) arrays of a dict of lists of docids, in the order of docids"""
+    indptr = np.zeros(len(docids) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(lists.get(i, [])) for i in docids])
+    indices = np.fromiter((j for i in docids for j in lists.get(i, [])), dtype=np.int32, count=indptr[-1])
+    return indptr, indices
+
+
+def write_snapshot(records, path=config.SNAPSHOT_DIR, watermark=None):
+    """
+    Function to write the snapshot files of a dict of records (see harvest_records).
+    The files are written in a temporary directory which then replaces the current snapshot, the workers pick the new one up on their next read.
+
+    Args
+    ----------
+    records (dict) : the records by docid
+    path (str) : the snapshot directory
+    watermark (str, default None) : the most recent update date of the records
+    """
+    docids = np.array(sorted(records.keys()), dtype=np.int32)
+    parents = {i: [int(p) for p in records[i].get('parentDocid_i', [])] for i in records}
+    children = {}
+    for child, parent_list in parents.items():
+        for parent in parent_list:
+            children.setdefault(parent, []).append(child)
+    tmp = path + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(os.path.join(tmp, 'docids.npy'), docids)
+    for name, lists in [('children', children), ('parents', parents)]:
+        indptr, indices = csr(lists, docids.tolist())
+        np.save(os.path.join(tmp, name + '_indptr.npy'), indptr)
+        np.save(os.path.join(tmp, name + '.npy'), indices)
+    for field in META_FIELDS:
+        values = []
+        for i in docids.tolist():
+            values.append(field_value(records[i], field).encode('utf-8'))
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(v) for v in values])
+        with open(os.path.join(tmp, field + '.bin'), 'wb') as f:
+            f.write(b''.join(values))
+        np.save(os.path.join(tmp, field + '_offsets.npy'), offsets)
+    if watermark is None:
+        watermark = max([r.get(UPDATE_FIELD, '') for r in records.values()], default='')
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'count': len(docids), 'watermark': watermark}, f)
+    old = path + '.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old)
+    os.rename(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def build_snapshot(path=config.SNAPSHOT_DIR):
+    """Function to mirror the whole Aurehal referential in a new snapshot"""
+    records = harvest_records()
+    write_snapshot(records, path)
+    return len(records)
+
+
+def refresh_snapshot(path=config.SNAPSHOT_DIR, prune=False):
+    """
+    Function to update a snapshot with the structures modified since its last sync watermark (UPDATE_FIELD of the ref/structure HAL API).
+    The modified records replace the old ones, so a new parent list (re-parenting) or a new status (VALID -> OLD) is taken into account,
+    and the snapshot files are rewritten locally with the new watermark. The cached HAL responses involving these structures are purged.
+    The records of the watermark date are requested again (a structure modified later in the same second must not be missed),
+    the ones identical to the snapshot records are left out : a refresh without changes doesn't rewrite the snapshot nor purge the cache.
+    The structures deleted from the referential have no update date : they stay in the snapshot unless prune is set,
+    then the docids of the whole referential are listed (one light request by config.SNAPSHOT_ROWS structures) and the missing ones are removed.
+
+    Args
+    ----------
+    path (str) : the snapshot directory
+    prune (bool, default False) : remove the structures deleted from the referential
+
+    Return
+    -------
+    returns the number of modified or removed structures
+    """
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return build_snapshot(path)
+    snapshot = Snapshot(path)
+    watermark = snapshot.meta.get('watermark', '')
+    if watermark == '':
+        return build_snapshot(path)
+    changes = harvest_records('{}:[{} TO *]'.format(UPDATE_FIELD, watermark))
+    records = snapshot.records()
+    changes = {docid: record for docid, record in changes.items() if (docid not in records) or not same_record(record, records[docid])}
+    deleted = set(records) - set(harvest_records(fields=[])) if prune else set()
+    if not (changes or deleted):
+        return 0
+    # old and new parents are purged from the cache as well, their children lists have changed
+    touched = set(deleted)
+    for docid in deleted:
+        touched.update(records.pop(docid).get('parentDocid_i', []))
+    for docid, record in changes.items():
+        touched.add(docid)
+        touched.update(records.get(docid, {}).get('parentDocid_i', []))
+        touched.update(record.get('parentDocid_i', []))
+        records[docid] = record
+    write_snapshot(records, path, max([watermark] + [r.get(UPDATE_FIELD, '') for r in changes.values()]))
+    if cache is not None:
+        for docid in touched:
+            cache.purge_docid(docid)
+    return len(changes) + len(deleted)
+
+
+class Snapshot:
+    """Read access to the memory-mapped files of a snapshot directory"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.docids = self.load('docids.npy')
+        self.adjacency = {name: (self.load(name + '_indptr.npy'), self.load(name + '.npy')) for name in ['children', 'parents']}
+        self.columns = {}
+        for field in META_FIELDS:
+            size = os.path.getsize(os.path.join(path, field + '.bin'))
+            blob = np.memmap(os.path.join(path, field + '.bin'), dtype=np.uint8, mode='r') if size else np.zeros(0, dtype=np.uint8)
+            self.columns[field] = (blob, self.load(field + '_offsets.npy'))
+
+    def load(self, name):
+        return np.load(os.path.join(self.path, name), mmap_mode='r')
+
+    def rows(self, docid_list):
+        """Returns the (docid, row) of the docids of the list which are in the snapshot"""
+        ids = np.array([int(i) for i in docid_list], dtype=np.int64)
+        if len(self.docids) == 0:
+            return []
+        rows = np.searchsorted(self.docids, ids)
+        rows[rows >= len(self.docids)] = 0
+        found = np.asarray(self.docids[rows]) == ids
+        return list(zip(ids[found].tolist(), rows[found].tolist()))
+
+    def neighbours(self, name, docid_list):
+        """Returns the (docid, neighbour docids) of the docids of the list for the children or parents adjacency"""
+        indptr, indices = self.adjacency[name]
+        return [(docid, indices[indptr[row]:indptr[row + 1]].tolist()) for docid, row in self.rows(docid_list)]
+
+    def value(self, field, row):
+        blob, offsets = self.columns[field]
+        return bytes(blob[offsets[row]:offsets[row + 1]]).decode('utf-8')
+
+    def docs(self, docid_list, fields=META_FIELDS):
+        """
+        Returns the docs of the docids in the snapshot, shaped like the ref/structure HAL API docs
+        Example : [{'docid': 1039632, 'parentDocid_i': [], 'acronym_s': 'UCA',...},...]
+        """
+        indptr, indices = self.adjacency['parents']
+        docs = []
+        for docid, row in self.rows(docid_list):
+            doc = {'docid': docid}
+            for field in fields:
+                if field == 'parentDocid_i':
+                    doc[field] = indices[indptr[row]:indptr[row + 1]].tolist()
+                    continue
+                value = self.value(field, row)
+                if value != '':
+                    doc[field] = value.split('\t') if field == 'idref_s' else value
+            docs.append(doc)
+        return docs
+
+    def records(self):
+        """Returns the whole snapshot as a dict of records (see harvest_records)"""
+        return {doc.pop('docid'): doc for doc in self.docs(self.docids.tolist(), ['parentDocid_i'] + META_FIELDS)}
+
+
+loaded = None
+
+def load_snapshot(path=config.SNAPSHOT_DIR):
+    """
+    Returns the Snapshot of the directory, or None if there is no snapshot or if it is disabled.
+    The snapshot is reloaded when its meta.json changes (new build or refresh).
+    """
+    global loaded
+    meta = os.path.join(path, 'meta.json')
+    if (not config.SNAPSHOT_ENABLED) | (not os.path.exists(meta)):
+        return None
+    mtime = os.path.getmtime(meta)
+    if (loaded is None) or (loaded[0] != path) or (loaded[1] != mtime):
+        loaded = (path, mtime, Snapshot(path))
+    return loaded[2]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mirror the Aurehal structures referential in a local snapshot")
+    parser.add_argument('command', choices=['build', 'refresh'])
+    parser.add_argument('--path', default=config.SNAPSHOT_DIR)
+    parser.add_argument('--prune', action='store_true', help="refresh : remove the structures deleted from the referential")
+    args = parser.parse_args()
+    if args.command == 'build':
+        print('{} structures'.format(build_snapshot(args.path)))
+    elif args.command == 'refresh':
+        print('{} structures updated'.format(refresh_snapshot(args.path, prune=args.prune)))
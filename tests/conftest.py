@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import tempfile
+import pytest
+
+# the runtime files of the app (cache, locks, jobs, graphs, metrics) go to a temporary directory, set before config.py is read
+RUNTIME_DIR = tempfile.mkdtemp(prefix='aurehal-tests-')
+for variable, name in [('AUREHAL_CACHE_PATH', 'hal_cache.sqlite'), ('AUREHAL_SNAPSHOT_DIR', 'snapshot'), ('AUREHAL_LOCKS_DIR', 'locks'),
+                       ('AUREHAL_JOBS_DIR', 'jobs'), ('AUREHAL_GRAPHS_DIR', 'graphs'), ('AUREHAL_METRICS_DIR', 'metrics')]:
+    os.environ[variable] = os.path.join(RUNTIME_DIR, name)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+import functions as fn
+import hal_stub
+from hal_client import client, TokenBucket
+
+
+@pytest.fixture
+def records():
+    """Synthetic hierarchy of 85 structures under the docid 1, with structures of several parents"""
+    return hal_stub.synthetic(root=1, depth=3, fanout=4, multi_parent_rate=0.3)
+
+
+@pytest.fixture
+def stub(monkeypatch, records):
+    """HAL stub answering in-process to the HAL client, without the responses cache, the local snapshot and the rate limit"""
+    stub = hal_stub.StubHal(records)
+    monkeypatch.setattr(fn, 'cache', None)
+    monkeypatch.setattr(config, 'SNAPSHOT_ENABLED', False)
+    monkeypatch.setattr(client, 'transport', hal_stub.StubTransport(stub))
+    monkeypatch.setattr(client, 'bucket', TokenBucket(rate=1e9, burst=1e9))
+    return stub
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import json
+import pandas as pd
+import app
+from graph_data import HarvestGraph, typed_nodes
+
+PARAMS = {'color': 'valid_s', 'size': 'non', 'form': 'dot', 'valid_s': ['VALID', 'OLD', 'INCOMING'],
+          'type_s': ['regroupinstitution', 'institution', 'regrouplaboratory', 'laboratory', 'department', 'researchteam'],
+          'title': None, 'direction': 'UD', 'layout': False, 'expanded': []}
+
+FRAME = pd.DataFrame({'id': [1039632, 409, 302940], 'nb_publis': pd.Series([10, 0, 250], dtype='int32'),
+                      'acronym_s': ['LAB', 'UNIV', None], 'has_idref': pd.Categorical(['oui', 'non', 'oui'], categories=['non', 'oui'])})
+
+
+def ids(df):
+    return df['id'].tolist()
+
+
+def test_split_filter_part():
+    assert app.split_filter_part('{nb_publis} > 10') == ('nb_publis', 'gt', 10.0)
+    assert app.split_filter_part('{acronym_s} contains "L\\"A"') == ('acronym_s', 'contains', 'L"A')
+    assert app.split_filter_part('no operator') == [None] * 3
+
+
+def test_query_frame_filters():
+    assert ids(app.query_frame(FRAME, [], '{nb_publis} >= 10')) == [1039632, 302940]
+    assert ids(app.query_frame(FRAME, [], '{nb_publis} > 5 && {nb_publis} < 100')) == [1039632]
+    # the ids are compared as text, without the decimal part of the parsed value
+    assert ids(app.query_frame(FRAME, [], '{id} contains 1039632')) == [1039632]
+    assert ids(app.query_frame(FRAME, [], '{acronym_s} contains lab')) == [1039632]
+    assert ids(app.query_frame(FRAME, [], '{has_idref} = oui')) == [1039632, 302940]
+    assert ids(app.query_frame(FRAME, [], '{acronym_s} = UNIV')) == [409]
+    # unknown columns and empty queries are ignored
+    assert ids(app.query_frame(FRAME, [], '{unknown} = 1')) == ids(FRAME)
+    assert ids(app.query_frame(FRAME, None, None)) == ids(FRAME)
+
+
+def test_query_frame_text_on_numbers():
+    # a number in quotes is compared as a number
+    assert ids(app.query_frame(FRAME, [], '{nb_publis} > "100"')) == [302940]
+    # a text matches no number
+    for operator in ['>', '>=', '<', '<=', '=']:
+        assert ids(app.query_frame(FRAME, [], '{{nb_publis}} {} abc'.format(operator))) == []
+    assert ids(app.query_frame(FRAME, [], '{nb_publis} != abc')) == ids(FRAME)
+
+
+def test_query_frame_sort():
+    assert ids(app.query_frame(FRAME, [{'column_id': 'nb_publis', 'direction': 'desc'}], '')) == [302940, 1039632, 409]
+    # the missing values are sorted as text ('None'), the sort is stable
+    assert ids(app.query_frame(FRAME, [{'column_id': 'acronym_s', 'direction': 'asc'}], '')) == [1039632, 302940, 409]
+    assert ids(app.query_frame(FRAME, [{'column_id': 'has_idref', 'direction': 'asc'}, {'column_id': 'id', 'direction': 'asc'}], '')) == [409, 302940, 1039632]
+
+
+def nodes(docids, valid_s='VALID'):
+    return typed_nodes(pd.DataFrame({'id': docids, 'nb_publis': [10 * i for i in docids], 'acronym_s': ['S{}'.format(i) for i in docids],
+                                     'label_s': ['Structure {}'.format(i) for i in docids], 'valid_s': valid_s, 'type_s': 'laboratory'}))
+
+
+def test_network_diff():
+    graph = HarvestGraph().add(nodes([1, 2, 3]).assign(valid_s=pd.Categorical(['VALID', 'OLD', 'VALID'])),
+                               [{'from': 1, 'to': 2}, {'from': 1, 'to': 3}])
+    render = app.render_frame(graph)
+    # a new graph replaces the content of the network
+    script = app.network_diff('g', graph, render, PARAMS, None)
+    assert script.startswith('this.nn.clear();this.ee.clear();')
+    state = {'graph': 'g', 'nodes': len(render['nodes']), 'edges': len(render['edges']), 'params': PARAMS}
+    # same controls : nothing to send
+    assert app.network_diff('g', graph, render, PARAMS, state) == ''
+    # a filter removes the OLD structures only
+    params = dict(PARAMS, valid_s=['VALID'])
+    script = app.network_diff('g', graph, render, params, state)
+    assert script == 'this.nn.remove([2]);'
+    # a new level adds its nodes and edges only
+    bigger = graph.add(nodes([4]), [{'from': 3, 'to': 4}])
+    bigger_render = app.render_frame(bigger)
+    script = app.network_diff('g', bigger, bigger_render, PARAMS, state)
+    assert not script.startswith('this.nn.clear()')
+    assert 'this.ee.update([{"from": 3, "to": 4' in script
+    added = json.loads(script[script.index('this.nn.update(') + len('this.nn.update('):script.index(');this.ee.update')])
+    assert [node['id'] for node in added] == [4]
+    # with the sizes by rollups, the structures above the new ones are updated too
+    rollup_state = dict(state, params=dict(PARAMS, size='descendants'))
+    script = app.network_diff('g', bigger, bigger_render, dict(PARAMS, size='descendants'), rollup_state)
+    updated = json.loads(script[script.index('this.nn.update(') + len('this.nn.update('):script.index(');this.ee.update')])
+    assert sorted(node['id'] for node in updated) == [1, 2, 3, 4]
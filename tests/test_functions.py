@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import time
+import pytest
+import functions as fn
+from hal_cache import HalCache
+from snapshot import META_FIELDS
+
+
+def edge_set(edges):
+    return set((int(e['from']), int(e['to'])) for e in edges)
+
+
+def ancestors(records, docid):
+    """(parent, child) edges of all the ancestors of a structure"""
+    edges = set()
+    level = [docid]
+    while level:
+        next_level = []
+        for child in level:
+            for parent in records[child]['parentDocid_i']:
+                if (parent, child) not in edges:
+                    edges.add((parent, child))
+                    next_level.append(parent)
+        level = next_level
+    return edges
+
+
+def test_get_child_struct(stub, records):
+    edges = fn.get_child_struct('1', None)
+    assert edge_set(edges) == set((parent, docid) for docid, record in records.items() for parent in record['parentDocid_i'])
+    assert len(edges) == len(edge_set(edges))
+    # ids formats of the original functions : root as given, children as int
+    assert set(type(e['from']) for e in edges if int(e['from']) == 1) == {str}
+    assert all(isinstance(e['to'], int) for e in edges)
+
+
+def test_get_parent_struct(stub, records):
+    leaf = max(records)
+    edges = fn.get_parent_struct(str(leaf), None)
+    assert edge_set(edges) == ancestors(records, leaf)
+    assert all(isinstance(e['from'], str) for e in edges)
+
+
+def test_get_list_struct_infos(stub, records):
+    docids = [1, 2, 30, 85]
+    df = fn.get_list_struct_infos(docids)
+    assert list(df['id']) == docids
+    assert set(['id', 'nb_publis', 'dot', 'no_dot'] + [field for field in META_FIELDS if field != 'address_s']) <= set(df.columns)
+    assert list(df['nb_publis']) == [records[docid]['nb_publis'] for docid in docids]
+    assert list(df['acronym_s']) == [records[docid]['acronym_s'] for docid in docids]
+    assert list(df['no_dot']) == ['image' if 'idref_s' in records[docid] else 'dot' for docid in docids]
+
+
+def test_get_nb_pub_by_structs(stub, records, monkeypatch):
+    monkeypatch.setattr(fn, 'FACET_QUERY_CHUNK_SIZE', 10)
+    docids = list(records)[:25]
+    assert fn.get_nb_pub_by_structs(docids) == {docid: records[docid]['nb_publis'] for docid in docids}
+    # 3 faceted requests of at most 10 structures
+    assert stub.requests == 3
+
+
+def test_traverse_max_depth(stub, records):
+    result = fn.traverse('1', 'desc', max_depth=1)
+    children = [docid for docid, record in records.items() if 1 in record['parentDocid_i']]
+    assert edge_set(result) == set((1, child) for child in children)
+    assert sorted(result.frontier) == children
+    assert not result.truncated
+
+
+def test_traverse_max_nodes(stub):
+    result = fn.traverse('1', 'desc', max_nodes=10)
+    assert result.truncated
+    nodes = set(int(i) for e in result for i in (e['from'], e['to']))
+    assert len(nodes) <= 10
+    # the structures with children left out stay in the frontier
+    assert set(int(i) for i in result.frontier) - nodes == set()
+    assert result.frontier
+
+
+def test_traverse_deadline(stub):
+    result = fn.traverse('1', 'desc', deadline=0)
+    assert result.truncated
+    assert list(result) == []
+    assert result.frontier == ['1']
+
+
+def test_traverse_on_level_failure(stub):
+    def slow_failure(new_edges, new_ids):
+        time.sleep(0.2)
+        raise TimeoutError()
+
+    # after the deadline, the level is left out and its structures stay in the frontier
+    result = fn.traverse('1', 'desc', on_level=slow_failure, deadline=0.1)
+    assert result.truncated
+    assert list(result) == []
+    assert result.frontier == ['1']
+    # before the deadline, the error goes up
+    with pytest.raises(TimeoutError):
+        fn.traverse('1', 'desc', on_level=slow_failure, deadline=60)
+
+
+def test_traverse_cancelled(stub):
+    result = fn.traverse('1', 'desc', cancelled=lambda: True)
+    assert list(result) == []
+    assert not result.truncated
+
+
+def test_structures_shared_by_batches(stub, records, monkeypatch, tmp_path):
+    monkeypatch.setattr(fn, 'cache', HalCache(str(tmp_path / 'cache.sqlite')))
+    first = fn.get_nb_pub_by_structs([1, 2, 3])
+    assert stub.requests == 1
+    # only the structures missing from the cache are requested
+    second = fn.get_nb_pub_by_structs([2, 3, 4])
+    assert stub.requests == 2
+    assert second == {docid: records[docid]['nb_publis'] for docid in [2, 3, 4]}
+    assert first[2] == second[2]
+    fn.get_child_struct('1', None)
+    requests = stub.requests
+    # the subtree of a structure of the first harvest is in the cache
+    edges = fn.get_child_struct('2', None)
+    assert stub.requests == requests
+    assert edges
+    # the responses of a structure are purged with it
+    assert fn.cache.purge_docid(2) == 2
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import pickle
+import numpy as np
+import pandas as pd
+from graph_data import HarvestGraph, NODE_COLUMNS, subtree_rollups, typed_nodes
+
+
+def nodes(docids, valid_s='VALID'):
+    return typed_nodes(pd.DataFrame({'id': docids, 'nb_publis': [10 * i for i in docids], 'acronym_s': ['S{}'.format(i) for i in docids],
+                                     'label_s': ['Structure {}'.format(i) for i in docids], 'valid_s': valid_s, 'type_s': 'laboratory'}))
+
+
+def test_subtree_rollups():
+    # a diamond 0 -> 1, 2 -> 3 and a cycle 3 -> 4 -> 1
+    src, dst = np.array([0, 0, 1, 2, 3, 4]), np.array([1, 2, 3, 3, 4, 1])
+    descendants, height, total = subtree_rollups(5, src, dst, [1, 10, 100, 1000, 10000])
+    assert descendants.tolist() == [4, 2, 2, 1, 0]
+    assert height.tolist() == [3, 2, 2, 1, 0]
+    # 3 and 4 are counted once under 0
+    assert total.tolist() == [11111, 11010, 11100, 11000, 10000]
+
+
+def test_subtree_rollups_forest():
+    descendants, height, total = subtree_rollups(4, np.array([0, 2]), np.array([1, 3]), [1, 2, 3, 4])
+    assert descendants.tolist() == [1, 0, 1, 0]
+    assert total.tolist() == [3, 2, 7, 4]
+
+
+def test_graph_add():
+    graph = HarvestGraph().add(nodes([1, 2]), [{'from': '1', 'to': 2}])
+    bigger = graph.add(nodes([3]), [{'from': 1, 'to': 3}, {'from': 3, 'to': 99}], frontier=[3])
+    # the previous graph is unchanged, the edges to unknown structures are left out
+    assert len(graph) == 2 and len(graph.src) == 1
+    assert bigger.edge_frame().values.tolist() == [[1, 2], [1, 3]]
+    assert bigger.rows(['3', 99]).tolist() == [2, -1]
+    assert bigger.frontier.tolist() == [3]
+
+
+def test_typed_nodes():
+    df = typed_nodes(pd.DataFrame({'id': ['1039632', 409], 'nb_publis': ['', 12], 'label_s': ['UCA', None],
+                                   'valid_s': ['VALID', 'OLD'], 'idref_s': [['123'], None]}))
+    assert list(df.columns) == NODE_COLUMNS
+    assert df['id'].dtype == 'int64' and df['id'].tolist() == [1039632, 409]
+    # the missing publications counts are 0
+    assert df['nb_publis'].dtype == 'int32' and df['nb_publis'].tolist() == [0, 12]
+    assert df['valid_s'].dtype == 'category' and df['has_idref'].tolist() == [True, False]
+    assert df['acronym_s'].isna().all()
+    assert len(typed_nodes(None)) == 0
+
+
+def test_graph_pickle_and_categories():
+    graph = HarvestGraph().add(nodes([1]), []).add(nodes([2], valid_s='OLD'), [{'from': 1, 'to': '2'}])
+    # the categories of the levels are merged instead of falling back to object columns
+    assert graph.nodes['valid_s'].dtype == 'category'
+    assert graph.nodes['valid_s'].tolist() == ['VALID', 'OLD']
+    graph.rollups()
+    # the cache of the render attributes is not pickled
+    copy = pickle.loads(pickle.dumps(graph))
+    assert copy.cache == {} and copy.edge_frame().values.tolist() == [[1, 2]]
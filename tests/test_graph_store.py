@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+from graph_data import HarvestGraph
+from graph_store import GraphStore
+
+GRAPH_ID = 'a' * 32
+
+
+def test_put_get(tmp_path):
+    store = GraphStore(str(tmp_path), memory=1)
+    graph = HarvestGraph()
+    store.put(GRAPH_ID, graph)
+    # the memory copy is served as is
+    assert store.get(GRAPH_ID) is graph
+    # another worker reads the pickle
+    other = GraphStore(str(tmp_path))
+    assert len(other.get(GRAPH_ID)) == 0 and other.get(GRAPH_ID) is not graph
+    # only the last used graphs stay in memory
+    store.put('b' * 32, HarvestGraph())
+    assert list(store.graphs) == ['b' * 32]
+    assert store.get('c' * 32) is None
+
+
+def test_invalid_ids(tmp_path):
+    store = GraphStore(str(tmp_path))
+    for graph_id in [None, '../jobs/x', GRAPH_ID.upper(), GRAPH_ID + '0']:
+        assert store.get(graph_id) is None
+        with pytest.raises(ValueError):
+            store.put(graph_id, HarvestGraph())
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_cleanup(tmp_path):
+    store = GraphStore(str(tmp_path), ttl=60)
+    store.put(GRAPH_ID, HarvestGraph())
+    store.put('b' * 32, HarvestGraph())
+    os.utime(store.file(GRAPH_ID), (0, 0))
+    store.cleanup()
+    assert os.listdir(str(tmp_path)) == ['b' * 32 + '.pkl']
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import config
+import functions as fn
+from hal_cache import HalCache, docids_of
+
+
+def test_docids_of():
+    assert docids_of('https://api/search/?q=authStructId_i:(1 OR 22)&facet.query=authStructId_i:333') == {'1', '22', '333'}
+
+
+def test_evict(tmp_path):
+    cache = HalCache(str(tmp_path / 'cache.sqlite'), max_bytes=10 ** 9)
+    bodies = {'https://api/ref/structure/?q=docid:({})'.format(i): str(i) * 1000 for i in range(5)}
+    for url, body in bodies.items():
+        cache.set(url, body)
+    # least recently used first : 3, 1, 0, 4, 2
+    for accessed, i in enumerate([3, 1, 0, 4, 2]):
+        cache.conn().execute("UPDATE responses SET accessed = ? WHERE url = ?", (accessed, 'https://api/ref/structure/?q=docid:({})'.format(i)))
+    sizes = dict(cache.conn().execute("SELECT url, size FROM responses").fetchall())
+    cache.max_bytes = sum(sizes.values()) - 1
+    cache.evict()
+    assert cache.get('https://api/ref/structure/?q=docid:(3)') is None
+    assert cache.conn().execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 4
+    cache.max_bytes = sizes['https://api/ref/structure/?q=docid:(2)']
+    cache.evict()
+    assert [row[0] for row in cache.conn().execute("SELECT url FROM responses")] == ['https://api/ref/structure/?q=docid:(2)']
+    assert cache.get('https://api/ref/structure/?q=docid:(2)')[0] == bodies['https://api/ref/structure/?q=docid:(2)']
+    # nothing to evict under the limit
+    cache.evict()
+    assert cache.get('https://api/ref/structure/?q=docid:(2)') is not None
+
+
+def test_ttl_and_purge(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'CACHE_TTL', {'ref/structure': 10, 'search': 5})
+    monkeypatch.setattr(config, 'CACHE_STALE', 100)
+    cache = HalCache(str(tmp_path / 'cache.sqlite'))
+    ref, search = 'https://api/ref/structure/?q=parentDocid_i:(1 OR 2)', 'https://api/search/?q=authStructId_i:2&rows=0'
+    assert cache.is_fresh(ref, 9) and not cache.is_fresh(search, 9)
+    assert cache.is_stale(search, 9) and not cache.is_stale(search, 106)
+    cache.set(ref, 'children')
+    cache.set(search, 'count')
+    cache.set('https://api/ref/structure/?q=docid:(12)', 'other')
+    assert cache.get(ref)[0] == 'children' and cache.get(ref)[1] < 5
+    # the responses of the queries involving 2, and not 12
+    assert cache.purge_docid(2) == 2
+    assert cache.get(ref) is None and cache.get(search) is None
+    assert cache.get('https://api/ref/structure/?q=docid:(12)') is not None
+
+
+def test_cached(stub, monkeypatch, tmp_path):
+    monkeypatch.setattr(fn, 'cache', HalCache(str(tmp_path / 'cache.sqlite')))
+    url = fn.count_url(2)
+    body = fn.hal_get_many([url])[0]
+    assert stub.requests == 1
+    # fresh : served from the cache
+    assert fn.hal_get_many([url])[0] == body
+    assert stub.requests == 1
+    # expired but in the stale window : served and refreshed in background
+    fn.cache.conn().execute("UPDATE responses SET created = created - ?", (config.CACHE_TTL['search'] + 1,))
+    assert json.loads(fn.cached(url)) == body
+    limit = time.monotonic() + 5
+    while (stub.requests < 2) or fn.refreshing:
+        assert time.monotonic() < limit
+        time.sleep(0.01)
+    assert fn.cache.is_fresh(url, fn.cache.get(url)[1])
+    # beyond the stale window : requested again
+    fn.cache.conn().execute("UPDATE responses SET created = 0")
+    assert fn.cached(url) is None
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+import time
+import asyncio
+import threading
+import pytest
+import requests
+from hal_client import HalClient, TokenBucket
+
+
+class FakeTransport:
+    """Answers the url itself after a delay, fails the first attempts of the urls in failures with a 503"""
+
+    def __init__(self, delay=0.0, failures=None):
+        self.delay = delay
+        self.failures = dict(failures or {})
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def get(self, url, timeout):
+        with self.lock:
+            self.calls.append(url)
+            fail = self.failures.get(url, 0) > 0
+            if fail:
+                self.failures[url] -= 1
+        time.sleep(self.delay)
+        if fail:
+            resp = requests.Response()
+            resp.status_code = 503
+            raise requests.HTTPError('503', response=resp)
+        return url
+
+
+def new_client(transport, **options):
+    client = HalClient(max_concurrency=8, rate=1e9, burst=1e9, transport=transport, **options)
+    client.retry_options['wait'] = lambda retry_state: 0
+    return client
+
+
+def test_get_many_concurrent_and_ordered():
+    client = new_client(FakeTransport(delay=0.2))
+    urls = ['https://api/search/?q={}'.format(i) for i in range(8)]
+    start = time.monotonic()
+    assert client.get_many(urls) == urls
+    assert time.monotonic() - start < 0.8
+    assert client.get_many([]) == []
+
+
+def test_get_many_retries():
+    transport = FakeTransport(failures={'https://api/search/?q=1': 2})
+    client = new_client(transport)
+    assert client.get_many(['https://api/search/?q=0', 'https://api/search/?q=1']) == ['https://api/search/?q=0', 'https://api/search/?q=1']
+    assert transport.calls.count('https://api/search/?q=1') == 3
+    # no more attempts than retries
+    transport.failures['https://api/search/?q=2'] = 10
+    with pytest.raises(requests.HTTPError):
+        client.get_many(['https://api/search/?q=2'])
+
+
+def test_get_many_in_running_loop():
+    client = new_client(FakeTransport())
+
+    async def handler():
+        return client.get_many(['https://api/search/?q=0', 'https://api/search/?q=1'])
+
+    assert asyncio.run(handler()) == ['https://api/search/?q=0', 'https://api/search/?q=1']
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert [bucket.reserve() for _ in range(2)] == [0, 0]
+    # the third token comes 1/rate seconds later
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
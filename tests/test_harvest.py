@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import logging
+import xml.etree.ElementTree as ET
+import pytest
+import functions as fn
+import hal_stub
+import harvest
+from hal_client import client, TokenBucket
+
+NODES = [{'id': 1, 'nb_publis': 10, 'acronym_s': 'A&B', 'label_s': 'Structure <1>', 'valid_s': 'VALID', 'type_s': 'laboratory'},
+         {'id': 2, 'nb_publis': None, 'acronym_s': None, 'label_s': 'Structure 2', 'valid_s': 'OLD', 'type_s': 'researchteam'}]
+EDGES = [{'from': '1', 'to': 2}]
+
+
+def node(record):
+    return dict({field: None for field in harvest.NODE_FIELDS}, **record)
+
+
+def write(writer_class, path):
+    writer = writer_class(str(path))
+    writer.write([node(NODES[0])], [])
+    writer.write([node(NODES[1])], EDGES)
+    writer.close()
+    # the files are written with the .part suffix, renamed by harvest_root
+    assert all(os.path.exists(p + '.part') for p in writer.paths)
+    return [p + '.part' for p in writer.paths]
+
+
+def test_jsonl_writer(tmp_path):
+    [path] = write(harvest.JsonlWriter, tmp_path / 'g')
+    with open(path, encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert [(line['type'], line.get('id')) for line in lines] == [('node', 1), ('node', 2), ('edge', None)]
+    assert lines[0]['acronym_s'] == 'A&B' and lines[1]['nb_publis'] is None
+    assert lines[2] == {'type': 'edge', 'from': 1, 'to': 2}
+
+
+def test_graphml_writer(tmp_path):
+    [path] = write(harvest.GraphmlWriter, tmp_path / 'g')
+    ns = {'g': 'http://graphml.graphdrawing.org/xmlns'}
+    graph = ET.parse(path).getroot().find('g:graph', ns)
+    nodes = graph.findall('g:node', ns)
+    assert [n.get('id') for n in nodes] == ['1', '2']
+    data = {d.get('key'): d.text for d in nodes[0].findall('g:data', ns)}
+    assert data['acronym_s'] == 'A&B' and data['label_s'] == 'Structure <1>' and data['nb_publis'] == '10'
+    # the missing values are left out
+    assert 'acronym_s' not in {d.get('key') for d in nodes[1].findall('g:data', ns)}
+    assert [(e.get('source'), e.get('target')) for e in graph.findall('g:edge', ns)] == [('1', '2')]
+
+
+@pytest.mark.skipif(harvest.pa is None, reason='pyarrow is not installed')
+def test_parquet_writer(tmp_path):
+    nodes_path, edges_path = write(harvest.ParquetWriter, tmp_path / 'g')
+    nodes = harvest.pq.read_table(nodes_path).to_pylist()
+    assert [n['id'] for n in nodes] == [1, 2] and nodes[1]['nb_publis'] is None
+    assert harvest.pq.read_table(edges_path).to_pylist() == [{'from': 1, 'to': 2}]
+
+
+def test_harvest_root(stub, records, tmp_path):
+    report = harvest.harvest_root('1', 'desc', str(tmp_path), 'jsonl')
+    assert report['files'] == [str(tmp_path / '1_desc.jsonl')]
+    assert os.listdir(str(tmp_path)) == ['1_desc.jsonl']
+    with open(report['files'][0], encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    nodes = [line['id'] for line in lines if line['type'] == 'node']
+    edges = set((line['from'], line['to']) for line in lines if line['type'] == 'edge')
+    # each structure and edge is written once
+    assert sorted(nodes) == sorted(records)
+    assert edges == set((parent, docid) for docid, record in records.items() for parent in record['parentDocid_i'])
+    assert (report['nodes'], report['edges'], report['truncated']) == (len(records), len(edges), False)
+
+
+def test_streamed_traverse(records, monkeypatch, caplog):
+    # a cycle 2 -> ... -> 2 through a descendant of 2
+    descendant = next(docid for docid, record in records.items() if 2 in record['parentDocid_i'])
+    records[2]['parentDocid_i'].append(descendant)
+    monkeypatch.setattr(fn, 'cache', None)
+    monkeypatch.setattr(fn.config, 'SNAPSHOT_ENABLED', False)
+    monkeypatch.setattr(client, 'transport', hal_stub.StubTransport(hal_stub.StubHal(records)))
+    monkeypatch.setattr(client, 'bucket', TokenBucket(rate=1e9, burst=1e9))
+    with caplog.at_level(logging.WARNING):
+        kept = fn.traverse('1', 'desc')
+    assert 'cycle in the Aurehal graph of 1' in caplog.text
+    caplog.clear()
+    # the streamed result keeps the number of edges only
+    with caplog.at_level(logging.WARNING):
+        streamed = fn.traverse('1', 'desc', result=harvest.StreamedResult())
+    assert list(streamed) == [] and streamed.count == len(kept)
+    assert 'cycle' not in caplog.text
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import time
+import app
+import jobs
+from graph_store import store
+
+
+def wait_job(job_id, done=lambda job: job['status'] != 'running' and not job.get('expanding')):
+    limit = time.monotonic() + 10
+    while time.monotonic() < limit:
+        job = jobs.get_job(job_id)
+        if (job is not None) and done(job):
+            return job
+        time.sleep(0.02)
+    raise AssertionError('job {} not finished'.format(job_id))
+
+
+def children(records, docid):
+    return sorted(child for child, record in records.items() if docid in record['parentDocid_i'])
+
+
+def test_expand_node(stub, records):
+    job = wait_job(jobs.submit_job('1', 'desc', max_depth=1))
+    assert job['status'] == 'done'
+    graph = store.get(job['id'])
+    assert sorted(graph.frontier.tolist()) == children(records, 1)
+    node = children(records, 1)[0]
+    # not in the frontier
+    assert jobs.expand_node(job['id'], 1) is None
+    stub.latency = 0.2
+    version = jobs.expand_node(job['id'], node)
+    # the expansion runs in background, the job is marked until it ends
+    marked = jobs.get_job(job['id'])
+    assert (marked['version'], marked['expanding'], marked['status']) == (version, node, 'done')
+    assert jobs.expand_node(job['id'], children(records, 1)[1]) is None
+    # the page polls the job again, without the cancel button
+    assert app.poll_job(job['id'], job['version'])[1:4] == (version, False, True)
+    expanded = wait_job(job['id'])
+    assert expanded['version'] > version and expanded['expanding'] is None
+    graph = store.get(job['id'])
+    new_ids = [i for i in children(records, node) if i not in children(records, 1)]
+    assert set(children(records, node)) <= set(graph.nodes['id'])
+    assert sorted(graph.frontier.tolist()) == sorted(set(children(records, 1)) - {node} | set(new_ids))
+    assert expanded['progress']['nodes'] == len(graph)
+
+
+def test_expand_node_failure(stub, records, monkeypatch):
+    job = wait_job(jobs.submit_job('1', 'desc', max_depth=1))
+
+    def failure(*args, **kwargs):
+        raise ValueError('HAL is down')
+
+    monkeypatch.setattr(jobs.fn, 'traverse', failure)
+    node = children(records, 1)[0]
+    assert jobs.expand_node(job['id'], node) is not None
+    failed = wait_job(job['id'])
+    assert (failed['status'], failed['error'], failed['expanding']) == ('error', 'HAL is down', None)
+    # the structure stays in the frontier
+    assert node in store.get(job['id']).frontier
+
+
+def test_submit_job(stub, records):
+    stub.latency = 0.1
+    job_id = jobs.submit_job('1', 'desc')
+    # an identical harvest attaches to the running job, another one is a new job
+    assert jobs.submit_job('1', 'desc') == job_id
+    other = jobs.submit_job('1', 'desc', max_depth=1)
+    assert other != job_id
+    job = wait_job(job_id)
+    assert job['status'] == 'done' and not job['truncated']
+    assert job['progress']['nodes'] == len(records) and job['progress']['levels'] >= 3
+    assert len(store.get(job_id)) == len(records)
+    # a finished harvest is started again
+    again = jobs.submit_job('1', 'desc')
+    assert again != job_id
+    wait_job(other)
+    wait_job(again)
+
+
+def test_cancel_job(stub):
+    stub.latency = 0.1
+    job_id = jobs.submit_job('2', 'desc')
+    # the graph of the first level is saved before the end of the job
+    wait_job(job_id, lambda job: job['progress']['levels'] >= 1)
+    jobs.cancel_job(job_id)
+    job = wait_job(job_id)
+    assert job['status'] == 'cancelled'
+    assert len(store.get(job_id)) == job['progress']['nodes'] > 1
+    # a cancelled harvest is not attached to
+    again = jobs.submit_job('2', 'desc')
+    assert again != job_id
+    wait_job(again)
+
+
+def test_invalid_job_ids():
+    for job_id in [None, '../config', 'a' * 31]:
+        assert jobs.get_job(job_id) is None
+        assert jobs.expand_node(job_id, 1) is None
+        assert not jobs.is_cancelled(job_id)
+    assert jobs.get_log('../config') == (0, [])
+
+
+def test_log_ring_buffer(monkeypatch):
+    handler = jobs.JobLogHandler(size=3)
+    handler.setFormatter(jobs.logging.Formatter('%(message)s'))
+    monkeypatch.setattr(jobs, 'log_handler', handler)
+    logger = jobs.logging.getLogger('test_jobs')
+    logger.addHandler(handler)
+    logger.setLevel(jobs.logging.INFO)
+    job_id = 'a' * 32
+    try:
+        token = jobs.log_scope.set(job_id)
+        for i in range(5):
+            logger.info('line %d', i)
+        jobs.log_scope.reset(token)
+        # out of a job, the lines are not kept
+        logger.info('no job')
+    finally:
+        logger.removeHandler(handler)
+    # the last 3 lines are kept, numbered from the first one
+    assert jobs.get_log(job_id) == (5, ['line 2', 'line 3', 'line 4'])
+    assert jobs.get_log(job_id, cursor=4) == (5, ['line 4'])
+    assert jobs.get_log(job_id, cursor=5) == (5, [])
+    # once the job is finished, the lines come from its state
+    handler.drop(job_id)
+    assert jobs.get_log(job_id) == (0, [])
+
+
+def test_job_log(stub, caplog):
+    caplog.set_level(jobs.logging.INFO)
+    job = wait_job(jobs.submit_job('1', 'desc', max_depth=1))
+    # the HAL urls of the job are in its log, saved in its state once it ended
+    seq, lines = jobs.get_log(job['id'])
+    assert seq == job['log']['seq'] > 0
+    assert any('ref/structure' in line for line in lines)
+    assert jobs.get_log(job['id'], cursor=seq) == (seq, [])
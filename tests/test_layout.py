@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import config
+from layout import GraphLayout, longest_path_levels
+
+
+def test_longest_path_levels():
+    # 5 is under 0 and under 3 : one level under its lowest parent
+    levels, parents, children = longest_path_levels(6, [(0, 1), (0, 2), (1, 3), (2, 4), (3, 5), (0, 5)])
+    assert levels.tolist() == [0, 1, 1, 2, 2, 3]
+    assert parents[5] == [3, 0] and children[0] == [1, 2, 5]
+    # a cycle 1 -> 2 -> 1 under 0 : its nodes are put under their known parents
+    levels, _, _ = longest_path_levels(3, [(0, 1), (1, 2), (2, 1)])
+    assert levels.tolist() == [0, 1, 2]
+
+
+def test_layout_order_and_positions():
+    # the children of 1 and 2 are swapped to remove the crossing of their edges
+    layout = GraphLayout(5, [(0, 1), (0, 2), (1, 4), (2, 3)])
+    assert layout.levels.tolist() == [0, 1, 1, 2, 2]
+    assert layout.rank.tolist() == [0, 0, 1, 1, 0]
+    x, y = layout.positions('UD')
+    # centered levels
+    assert x.tolist() == [0, -0.5 * config.LAYOUT_NODE_SPACING, 0.5 * config.LAYOUT_NODE_SPACING,
+                          0.5 * config.LAYOUT_NODE_SPACING, -0.5 * config.LAYOUT_NODE_SPACING]
+    assert y.tolist() == [0, config.LAYOUT_LEVEL_SEPARATION, config.LAYOUT_LEVEL_SEPARATION,
+                          2 * config.LAYOUT_LEVEL_SEPARATION, 2 * config.LAYOUT_LEVEL_SEPARATION]
+    assert np.array_equal(layout.positions('DU')[1], -y)
+    assert np.array_equal(layout.positions('LR')[0], y) and np.array_equal(layout.positions('LR')[1], x)
+    assert GraphLayout(0, []).positions()[0].tolist() == []
+
+
+def test_clusters():
+    # 0 -> 1 -> 3, 4, 5 and 0 -> 2 -> 6, with 6 also under 1 : 6 hangs on 1 in the spanning tree
+    layout = GraphLayout(7, [(0, 1), (0, 2), (1, 3), (1, 4), (1, 5), (2, 6), (1, 6)])
+    assert layout.tree_parent.tolist() == [-1, 0, 0, 1, 1, 1, 1]
+    assert layout.subtree.tolist() == [7, 5, 1, 1, 1, 1, 1]
+    collapsed, hidden = layout.clusters([], size=2)
+    # the root is never collapsed, the nodes under a collapsed one are hidden
+    assert np.flatnonzero(collapsed).tolist() == [1]
+    assert np.flatnonzero(hidden).tolist() == [3, 4, 5, 6]
+    collapsed, hidden = layout.clusters([1], size=2)
+    assert not collapsed.any() and not hidden.any()
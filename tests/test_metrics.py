@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import subprocess
+import sys
+from metrics import Metrics
+
+
+def test_render(tmp_path):
+    metrics = Metrics(str(tmp_path), flush_every=3600)
+    metrics.inc('aurehal_hal_requests_total', endpoint='search', outcome='ok')
+    metrics.inc('aurehal_hal_requests_total', 2, endpoint='search', outcome='ok')
+    metrics.inc('aurehal_harvests_total', direction='desc', status='done')
+    for value in [0.07, 0.3, 42]:
+        metrics.observe('aurehal_hal_request_seconds', value, endpoint='search')
+    text = metrics.render()
+    lines = text.splitlines()
+    assert '# TYPE aurehal_hal_requests_total counter' in lines
+    assert 'aurehal_hal_requests_total{endpoint="search",outcome="ok"} 3' in lines
+    assert 'aurehal_harvests_total{direction="desc",status="done"} 1' in lines
+    assert '# TYPE aurehal_hal_request_seconds histogram' in lines
+    # cumulative buckets, the values above the last bound only in +Inf
+    assert 'aurehal_hal_request_seconds_bucket{endpoint="search",le="0.05"} 0' in lines
+    assert 'aurehal_hal_request_seconds_bucket{endpoint="search",le="0.1"} 1' in lines
+    assert 'aurehal_hal_request_seconds_bucket{endpoint="search",le="0.5"} 2' in lines
+    assert 'aurehal_hal_request_seconds_bucket{endpoint="search",le="30"} 2' in lines
+    assert 'aurehal_hal_request_seconds_bucket{endpoint="search",le="+Inf"} 3' in lines
+    assert 'aurehal_hal_request_seconds_count{endpoint="search"} 3' in lines
+    assert text.endswith('\n')
+
+
+def test_render_processes(tmp_path):
+    metrics = Metrics(str(tmp_path), flush_every=3600)
+    metrics.inc('aurehal_harvests_total', direction='asc', status='done')
+    data = {'counters': {'aurehal_harvests_total': {json.dumps([['direction', 'asc'], ['status', 'done']]): 4}}, 'histograms': {}}
+    # the values of another running process are summed, the file of a dead process is deleted
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    for pid in [os.getppid(), dead.pid]:
+        with open(str(tmp_path / '{}.json'.format(pid)), 'w') as f:
+            json.dump(data, f)
+    assert 'aurehal_harvests_total{direction="asc",status="done"} 5' in metrics.render().splitlines()
+    assert sorted(os.listdir(str(tmp_path))) == sorted(['{}.json'.format(os.getpid()), '{}.json'.format(os.getppid())])
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+from search_index import SearchIndex, normalize
+
+
+def frame(rows):
+    return pd.DataFrame(rows, columns=['id', 'label_s', 'acronym_s'])
+
+
+def index():
+    """A root 1, its children 2 and 3 (added with the first level) and 4 under 3 (second level)"""
+    index = SearchIndex()
+    index.add(frame([[1, "Université Côte d'Azur", 'UCA']]), [])
+    index.add(frame([[2, 'Laboratoire Jean-Alexandre Dieudonné', 'LJAD'], [3, 'Institut de Physique de Nice', 'INPHYNI']]),
+              [{'from': '1', 'to': 2}, {'from': '1', 'to': 3}])
+    index.add(frame([[4, 'Équipe Optique', None]]), [{'from': 3, 'to': 4}])
+    return index
+
+
+def test_normalize():
+    assert normalize("Université Côte d'Azur") == "universite cote d'azur"
+    assert normalize('ÉQUIPE') == 'equipe'
+    assert normalize(1039632) == '1039632'
+
+
+def test_search_folding():
+    idx = index()
+    # accents and case are folded in the query and the texts
+    assert idx.search('cote') == [0]
+    assert idx.search('CÔTE D’') == []
+    assert idx.search('équipe') == idx.search('EQUIPE') == [3]
+    # the acronyms and ids are searched too
+    assert idx.search('ljad') == [1]
+    assert idx.search('1') == [0]
+    # an empty query matches everything
+    assert idx.search('  ') == [0, 1, 2, 3]
+
+
+def test_search_prefix_and_trigrams():
+    idx = index()
+    # short queries : the words starting with the query
+    assert idx.search('ce') == []
+    assert idx.search('in') == [2]
+    assert idx.search('d') == [0, 1, 2]
+    # longer queries : anywhere in the texts, across the words
+    assert idx.search('nice') == [2]
+    assert idx.search('ique de n') == [2]
+    assert idx.search('lab jean') == []
+    assert idx.search('xyz') == []
+
+
+def test_ancestors():
+    idx = index()
+    assert len(idx) == 4
+    assert idx.depths == [0, 1, 1, 2]
+    # the structures on the paths to the root, the given ones included
+    assert idx.ancestors([3]) == [0, 2, 3]
+    assert idx.ancestors([1, 3]) == [0, 1, 2, 3]
+    assert idx.ancestors([0]) == [0]
+    assert idx.ancestors([]) == []
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import pytest
+import functions as fn
+from hal_cache import HalCache
+from singleflight import SingleFlight
+
+
+def test_single_flight_claim():
+    flights = SingleFlight()
+    owned, waiting = flights.claim(['a', 'b'])
+    assert (owned, waiting) == (['a', 'b'], {})
+    # the keys in flight are awaited, the others are owned
+    owned, other = flights.claim(['b', 'c'])
+    assert owned == ['c'] and list(other) == ['b']
+    flights.resolve(['a', 'b'], {'a': 1, 'b': 2})
+    assert other['b'].result(timeout=1)['b'] == 2
+    flights.resolve(['c'], {'c': 3})
+    # resolved keys can be claimed again
+    assert flights.claim(['a'])[0] == ['a']
+
+
+def test_single_flight_error():
+    flights = SingleFlight()
+    flights.claim(['a'])
+    _, waiting = flights.claim(['a'])
+    flights.resolve(['a'], error=ValueError('failed'))
+    with pytest.raises(ValueError):
+        waiting['a'].result(timeout=1)
+
+
+def test_single_flight_threads():
+    flights = SingleFlight()
+    computed = []
+    results = []
+    barrier = threading.Barrier(8)
+
+    def call():
+        barrier.wait()
+        owned, waiting = flights.claim(['key'])
+        if owned:
+            computed.append(1)
+            # let the other threads claim the key while it is in flight
+            threading.Event().wait(0.1)
+            flights.resolve(owned, {'key': 'value'})
+            results.append('value')
+        else:
+            results.append(waiting['key'].result(timeout=5)['key'])
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(computed) == 1
+    assert results == ['value'] * 8
+
+
+def test_cache_claims(tmp_path):
+    cache = HalCache(str(tmp_path / 'cache.sqlite'))
+    assert cache.claim(['a', 'b']) == ['a', 'b']
+    # claimed by another process
+    cache.conn().execute("UPDATE inflight SET owner = 'other' WHERE url = 'b'")
+    assert cache.in_flight(['a', 'b', 'c']) == {'a', 'b'}
+    cache.release(['a', 'b'])
+    assert cache.in_flight(['a', 'b']) == {'b'}
+    assert cache.claim(['a', 'b']) == ['a']
+    # the claim of a dead process expires
+    cache.conn().execute("UPDATE inflight SET expires = 0 WHERE url = 'b'")
+    assert cache.in_flight(['b']) == set()
+    assert cache.claim(['b']) == ['b']
+
+
+def run_threads(*calls):
+    threads = [threading.Thread(target=call) for call in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_disjoint_fetches_overlap(stub, records, monkeypatch, tmp_path):
+    monkeypatch.setattr(fn, 'cache', HalCache(str(tmp_path / 'cache.sqlite')))
+    stub.latency = 0.3
+    results = {}
+    docids = sorted(records)[1:]
+    first, second = docids[:40], docids[40:80]
+    start = time.monotonic()
+    run_threads(lambda: results.update(first=fn.get_nb_pub_by_structs(first)),
+                lambda: results.update(second=fn.get_nb_pub_by_structs(second)))
+    # the two fetches don't wait for each other
+    assert time.monotonic() - start < 0.55
+    assert results['first'] == {docid: records[docid]['nb_publis'] for docid in first}
+    assert results['second'] == {docid: records[docid]['nb_publis'] for docid in second}
+    assert fn.cache.in_flight(fn.count_url(docid) for docid in docids) == set()
+
+
+def test_claims_of_other_processes(stub, records, monkeypatch, tmp_path):
+    monkeypatch.setattr(fn, 'cache', HalCache(str(tmp_path / 'cache.sqlite')))
+    url = fn.count_url(7)
+    fn.get_nb_pub_by_structs([7])
+    body = fn.cache.get(url)[0]
+    fn.cache.clear()
+    stub.reset_counters()
+    results = []
+
+    def claimed_by_other():
+        fn.cache.conn().execute("INSERT INTO inflight VALUES (?, 'other', ?)", (url, time.time() + 60))
+
+    # the structure requested by another process is awaited in the cache
+    claimed_by_other()
+    thread = threading.Thread(target=lambda: results.append(fn.get_nb_pub_by_structs([7])))
+    thread.start()
+    time.sleep(0.2)
+    assert thread.is_alive()
+    fn.cache.set(url, body)
+    fn.cache.conn().execute("DELETE FROM inflight")
+    thread.join()
+    assert results[0] == {7: records[7]['nb_publis']}
+    assert stub.requests == 0
+    # the claim ended without a response (failed request) : requested by the waiting thread
+    fn.cache.clear()
+    claimed_by_other()
+    thread = threading.Thread(target=lambda: results.append(fn.get_nb_pub_by_structs([7])))
+    thread.start()
+    time.sleep(0.2)
+    fn.cache.conn().execute("DELETE FROM inflight")
+    thread.join()
+    assert results[1] == {7: records[7]['nb_publis']}
+    assert stub.requests == 1
+
+
+def test_claims_awaited_until_the_deadline(stub, monkeypatch, tmp_path):
+    monkeypatch.setattr(fn, 'cache', HalCache(str(tmp_path / 'cache.sqlite')))
+    fn.cache.conn().execute("INSERT INTO inflight VALUES (?, 'other', ?)", (fn.count_url(7), time.time() + 60))
+    token = fn.request_deadline.set(time.monotonic() + 0.2)
+    try:
+        with pytest.raises(TimeoutError):
+            fn.get_nb_pub_by_structs([7])
+    finally:
+        fn.request_deadline.reset(token)
+    assert stub.requests == 0
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import pytest
+import config
+import functions as fn
+import snapshot
+from hal_cache import HalCache
+
+
+def snapshot_records(path):
+    return snapshot.Snapshot(path).records()
+
+
+def test_build_snapshot(stub, records, monkeypatch, tmp_path):
+    # several pages of the cursor
+    monkeypatch.setattr(config, 'SNAPSHOT_ROWS', 10)
+    path = str(tmp_path / 'snapshot')
+    assert snapshot.build_snapshot(path) == len(records)
+    snap = snapshot.Snapshot(path)
+    assert snap.meta['count'] == len(records) and snap.meta['watermark'] == '2022-01-01T00:00:00Z'
+    assert dict(snap.neighbours('children', [1])) == {1: sorted(d for d, r in records.items() if 1 in r['parentDocid_i'])}
+    leaf = max(records)
+    [doc] = snap.docs([leaf, 10 ** 9])
+    assert doc['docid'] == leaf and doc['acronym_s'] == records[leaf]['acronym_s']
+    assert doc.get('idref_s') == records[leaf].get('idref_s')
+    assert dict(snap.neighbours('parents', [leaf]))[leaf] == records[leaf]['parentDocid_i']
+
+
+def test_refresh_snapshot(stub, records, monkeypatch, tmp_path):
+    path = str(tmp_path / 'snapshot')
+    snapshot.build_snapshot(path)
+    cache = HalCache(str(tmp_path / 'cache.sqlite'))
+    monkeypatch.setattr(snapshot, 'cache', cache)
+    cache.set('https://api/ref/structure/?q=parentDocid_i:(1)', '{}')
+    mtime = os.path.getmtime(os.path.join(path, 'meta.json'))
+    # the records of the watermark date are identical to the snapshot ones : nothing to rewrite nor purge
+    assert snapshot.refresh_snapshot(path) == 0
+    assert os.path.getmtime(os.path.join(path, 'meta.json')) == mtime
+    assert cache.get('https://api/ref/structure/?q=parentDocid_i:(1)') is not None
+    # a structure re-parented under 1 and a structure now OLD
+    moved = max(records)
+    old_parents = records[moved]['parentDocid_i']
+    records[moved] = dict(records[moved], parentDocid_i=[1], updateDate_tdate='2023-01-01T00:00:00Z')
+    valid = min(docid for docid, record in records.items() if record['valid_s'] == 'VALID')
+    records[valid] = dict(records[valid], valid_s='OLD', updateDate_tdate='2023-01-02T00:00:00Z')
+    assert snapshot.refresh_snapshot(path) == 2
+    snap = snapshot.Snapshot(path)
+    assert snap.meta['watermark'] == '2023-01-02T00:00:00Z'
+    assert dict(snap.neighbours('parents', [moved]))[moved] == [1]
+    assert moved in dict(snap.neighbours('children', [1]))[1]
+    assert all(moved not in children for _, children in snap.neighbours('children', old_parents))
+    assert snap.docs([valid])[0]['valid_s'] == 'OLD'
+    # the responses of the old and new parents are purged
+    assert cache.get('https://api/ref/structure/?q=parentDocid_i:(1)') is None
+    assert snapshot.refresh_snapshot(path) == 0
+
+
+def test_refresh_snapshot_prune(stub, records, tmp_path):
+    path = str(tmp_path / 'snapshot')
+    snapshot.build_snapshot(path)
+    leaf = max(records)
+    del records[leaf]
+    # without prune, the deleted structure stays
+    assert snapshot.refresh_snapshot(path) == 0
+    assert leaf in snapshot_records(path)
+    assert snapshot.refresh_snapshot(path, prune=True) == 1
+    assert sorted(snapshot_records(path)) == sorted(records)
+
+
+@pytest.fixture
+def default_snapshot(stub, monkeypatch):
+    """Snapshot of the stub records in config.SNAPSHOT_DIR, enabled"""
+    snapshot.build_snapshot(config.SNAPSHOT_DIR)
+    monkeypatch.setattr(config, 'SNAPSHOT_ENABLED', True)
+    yield
+    shutil.rmtree(config.SNAPSHOT_DIR)
+
+
+def test_harvest_from_snapshot(stub, records, default_snapshot):
+    # a structure created since the snapshot
+    new = max(records) + 1
+    records[new] = dict(records[max(records)], parentDocid_i=[])
+    stub.reset_counters()
+    edges = fn.get_child_struct('1', None)
+    assert set((int(e['from']), e['to']) for e in edges) == set((parent, docid) for docid, record in records.items() for parent in record['parentDocid_i'])
+    df = fn.get_list_struct_infos([1, 2, new])
+    assert list(df['acronym_s']) == [records[1]['acronym_s'], records[2]['acronym_s'], records[new]['acronym_s']]
+    # only the publications counts and the structure missing from the snapshot are requested
+    assert stub.requests == 2